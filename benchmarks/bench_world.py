@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Purpose: scaling benchmark of joint_ownership_problem module
+"""
+Scaling benchmark of World.add_person/remove_person on synthetic persons flows
+
+Measures latency percentiles of operations, EOCA cycles, transfers and (optionally) peak memory
+for each shape of benchmarks.generators and each scale (number of objects, number of events).
+Results are saved to json file to compare them between releases:
+
+    python -m benchmarks.bench_world --save benchmarks/results/eoca.json
+    python -m benchmarks.bench_world --compare benchmarks/results/eoca.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tracemalloc
+from time import perf_counter, strftime
+
+from joint_ownership_problem import apply_event, new_world, latency_percentiles as percentiles
+from benchmarks.generators import shapes
+
+default_scales = [(100, 300), (300, 600), (1000, 1000)]
+
+
+def run_flow(events, n_objects, world_kwargs=None):
+    """
+    Apply events to new World measuring each operation
+
+    :param events: iterable of events (see benchmarks.generators)
+    :param n_objects: number of objects
+    :param world_kwargs: dict, other World arguments
+    :return: dict of measurements
+    """
+    world = new_world(n_objects, **(world_kwargs or {}))
+    latencies = {'add': [], 'remove': []}
+    transfers = 0
+    time_start = perf_counter()
+    for event in events:
+        t = perf_counter()
+        apply_event(world, event)
+        latencies[event[0]].append(perf_counter() - t)
+        transfers += world.transfers
+    return {
+        'time': round(perf_counter() - time_start, 4),
+        'add': percentiles(latencies['add']),
+        'remove': percentiles(latencies['remove']),
+        'cycles': sum(gr.n_cycles for gr in world.groups.values()),
+        'transfers': transfers,
+        'persons': world.n_persons,
+    }
+
+
+def peak_memory(events, n_objects, world_kwargs=None):
+    """
+    Peak memory of applying events to new World (separate run as tracemalloc slows down operations)
+    :return: int, bytes
+    """
+    tracemalloc.start()
+    try:
+        run_flow(events, n_objects, world_kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def version():
+    """ Source version: output of "git describe" or None if not available """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(shape_names, scales, seed=0, memory=False):
+    """
+    Run benchmark for each shape and scale
+    :return: dict, {'meta': {...}, 'results': [{...}, ...]}
+    """
+    results = []
+    for shape in shape_names:
+        for n_objects, n_events in scales:
+            result = {'shape': shape, 'n_objects': n_objects, 'n_events': n_events}
+            result.update(run_flow(shapes[shape](n_objects, n_events, seed), n_objects))
+            if memory:
+                result['peak_memory'] = peak_memory(shapes[shape](n_objects, n_events, seed), n_objects)
+            print(f"{shape:14s} N={n_objects:<6d} M={n_events:<6d} {result['time']:8.3f}s "
+                  f"add p99={result['add']['p99']:.3f}ms remove p99={result['remove']['p99']:.3f}ms "
+                  f"cycles={result['cycles']} transfers={result['transfers']}")
+            results.append(result)
+    meta = {'seed': seed, 'date': strftime('%Y-%m-%d %H:%M:%S'),
+            'version': version(), 'python': platform.python_version()}
+    return {'meta': meta, 'results': results}
+
+
+def compare(report, report_base):
+    """
+    Print ratios of times, p99 latencies and cycles of report to report_base for same shapes and scales
+    """
+    base = {(r['shape'], r['n_objects'], r['n_events']): r for r in report_base['results']}
+    print(f"Compared to {report_base['meta']}:")
+    for r in report['results']:
+        b = base.get((r['shape'], r['n_objects'], r['n_events']))
+        if b is None:
+            continue
+        ratios = ' '.join(
+            f'{name}={value / base_value:.2f}' if base_value else f'{name}=-' for name, value, base_value in (
+                ('time', r['time'], b['time']),
+                ('add_p99', r['add']['p99'], b['add']['p99']),
+                ('remove_p99', r['remove']['p99'], b['remove']['p99']),
+                ('cycles', r['cycles'], b['cycles']),
+                ('transfers', r['transfers'], b['transfers'])))
+        print(f"{r['shape']:14s} N={r['n_objects']:<6d} M={r['n_events']:<6d} {ratios}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--shapes', nargs='+', choices=sorted(shapes), default=sorted(shapes))
+    parser.add_argument('--scales', nargs='+', metavar='N:M',
+                        help='numbers of objects and events, default: '
+                             + ' '.join(f'{n}:{m}' for n, m in default_scales))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--memory', action='store_true', help='measure peak memory (additional run)')
+    parser.add_argument('--save', metavar='PATH', help='save results to json file')
+    parser.add_argument('--compare', metavar='PATH', help='compare with results saved previously')
+    args = parser.parse_args(argv)
+
+    scales = [tuple(int(x) for x in scale.split(':')) for scale in args.scales] if args.scales else default_scales
+    report = run(args.shapes, scales, args.seed, args.memory)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Purpose: synthetic persons flows for benchmarks and tests of joint_ownership_problem module
+"""
+Seeded generators of persons flows
+
+Each generator yields events:
+    ('add', person, domain, lowprio) - add person with domain (set of objects), lowprio: bool
+    ('remove', person)               - remove person
+Persons are named by unique ints. Same arguments give same flow.
+"""
+
+from random import Random
+
+
+def persons_flow(n_objects, n_events, seed, domain_generator, p_remove=0.3, p_lowprio=0.0):
+    """
+    Generate flow of adding/removing persons
+
+    :param n_objects: number of objects in the world
+    :param n_events: number of events to generate
+    :param seed: random seed
+    :param domain_generator: function(rnd, n_objects) returning domain (set of objects) of new person
+    :param p_remove: probability of removing random person (if any) on each event
+    :param p_lowprio: probability of new person to be LOWPRIO
+    :yields: events (see module description)
+    """
+    rnd = Random(seed)
+    alive = []
+    for person in range(n_events):
+        if alive and rnd.random() < p_remove:
+            # remove random person: swap with last to remove in O(1)
+            i = rnd.randrange(len(alive))
+            alive[i], alive[-1] = alive[-1], alive[i]
+            yield 'remove', alive.pop()
+        else:
+            alive.append(person)
+            yield 'add', person, domain_generator(rnd, n_objects), rnd.random() < p_lowprio
+
+
+def ranges_generator(max_length):
+    """
+    Domain generator of random contiguous ranges of objects (see persons_flow())
+
+    :param max_length: maximum length of range
+    """
+    def domain(rnd, n_objects):
+        start = rnd.randrange(n_objects)
+        return set(range(start, min(n_objects, start + rnd.randint(1, max_length))))
+
+    return domain
+
+
+def random_ranges(n_objects, n_events, seed=0, max_length=None, p_remove=0.3):
+    """
+    Persons with random contiguous ranges of objects
+
+    :param max_length: maximum length of range, default n_objects // 4
+    """
+    if max_length is None:
+        max_length = max(1, n_objects // 4)
+    return persons_flow(n_objects, n_events, seed, ranges_generator(max_length), p_remove)
+
+
+def clusters(n_objects, n_events, seed=0, n_clusters=4, p_remove=0.3):
+    """
+    Persons with heavily overlapped domains: each domain is most part of one of n_clusters ranges
+
+    :param n_clusters: number of ranges of objects that persons share
+    """
+    size = max(1, n_objects // n_clusters)
+
+    def domain(rnd, n_objects):
+        start = rnd.randrange(n_clusters) * size
+        cluster = range(start, min(n_objects, start + size))
+        return set(rnd.sample(cluster, k=max(1, len(cluster) * rnd.randint(6, 10) // 10)))
+
+    return persons_flow(n_objects, n_events, seed, domain, p_remove)
+
+
+def tenants(n_objects, n_events, seed=0, n_tenants=8, p_remove=0.3):
+    """
+    Persons of disjoint tenants: each tenant has its own range of objects, persons of tenant
+    have random subsets of it
+
+    :param n_tenants: number of disjoint ranges of objects
+    """
+    size = max(1, n_objects // n_tenants)
+
+    def domain(rnd, n_objects):
+        start = rnd.randrange(n_tenants) * size
+        tenant = range(start, min(n_objects, start + size))
+        return set(rnd.sample(tenant, k=rnd.randint(1, len(tenant))))
+
+    return persons_flow(n_objects, n_events, seed, domain, p_remove)
+
+
+def mixed_churn(n_objects, n_events, seed=0, p_lowprio=0.3, p_remove=0.45):
+    """
+    Random ranges of LOWPRIO and normal persons with high removing rate
+
+    :param p_lowprio: probability of new person to be LOWPRIO
+    """
+    return persons_flow(n_objects, n_events, seed, ranges_generator(max(1, n_objects // 4)), p_remove, p_lowprio)
+
+
+shapes = {
+    'random_ranges': random_ranges,
+    'clusters': clusters,
+    'tenants': tenants,
+    'mixed_churn': mixed_churn,
+}
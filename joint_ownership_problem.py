@@ -11,8 +11,26 @@ o - objects
 p - persons (same as possible owners)
 """
 
-from collections import deque
-from operator import itemgetter
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from collections.abc import Mapping
+from contextlib import contextmanager, nullcontext
+from heapq import heapify, heappop, heappush
+from itertools import chain
+from multiprocessing import resource_tracker, shared_memory
+from operator import attrgetter, itemgetter
+from statistics import quantiles
+from time import perf_counter
 
 # General functions
 def bfs_paths(fun_graph, start, fun_goal):
@@ -44,23 +62,108 @@ def bfs_paths(fun_graph, start, fun_goal):
                 queue.append((next_node, path2next))
 
 
-def shortest_path(fun_graph, start, fun_goal):
+def shortest_path(fun_graph, start, fun_goal, key=None):
     """
     Return first occurrence of target node using Breadth First Search
 
+    Same as first path of bfs_paths() but each node is expanded only once, so search time is
+    linear in graph size even if target is not reachable.
+
     :param fun_graph: iterator, returns joint nodes on each call
     :param start: start node argument for fun_graph
     :param fun_goal: bool function(node) returning True if node is target
+    :param key: function(node) returning label of node. Nodes with same label must have same joint nodes
+        and only first of them is expanded. If None then node itself is label
     :return: list, shortest path through the nodes returned by fun_graph
 
     >>> graph = {'A': {'B', 'C'}, 'B': {'A', 'D', 'E'}, 'C': {'A', 'F'}, 'D': {'B'}, 'E': {'B', 'F'}, 'F': {'C', 'E'}}
     >>> shortest_path(lambda x: (x for x in graph[x]), 'A', lambda x: x == 'F')
     ['A', 'C', 'F']
     """
-    try:
-        return next(bfs_paths(fun_graph, start, fun_goal))
-    except StopIteration:
-        return []
+    if key is None:
+        key = lambda node: node
+    previous = {key(start): None}  # {key of node: (node, key of previous node)}
+    queue = deque([(start, key(start))])
+    while queue:
+        node, k = queue.popleft()
+        for next_node in fun_graph(node):
+            k_next = key(next_node)
+            if k_next in previous:
+                continue
+            previous[k_next] = (next_node, k)
+            if fun_goal(next_node):
+                path = [next_node]
+                while previous[k] is not None:
+                    node, k = previous[k]
+                    path.append(node)
+                path.append(start)
+                path.reverse()
+                return path
+            queue.append((next_node, k_next))
+    return []
+
+
+def max_reachable(nodes, fun_graph, fun_value):
+    """
+    Maximum value of nodes reachable from each node (including node itself)
+
+    Strongly connected components are found by Tarjan's algorithm (iterative) and values are
+    propagated over condensation graph, so time is linear in graph size.
+
+    :param nodes: iterable of nodes to start from
+    :param fun_graph: iterator, returns joint nodes on each call
+    :param fun_value: function(node) returning comparable value of node
+    :return: dict {node: maximum value of reachable nodes} for all nodes reachable from nodes
+
+    >>> graph = {'A': {'B'}, 'B': {'A', 'C'}, 'C': set(), 'D': {'A'}}
+    >>> max_reachable(graph, lambda x: graph[x], {'A': 1, 'B': 0, 'C': 2, 'D': 3}.get)
+    {'C': 2, 'B': 2, 'A': 2, 'D': 3}
+    """
+    index = {}      # {node: order of visiting}
+    low = {}        # {node: lowest index reachable through node's subtree in stack}
+    best = {}       # {node: result} filled when node's component is completed
+    stack = []      # nodes of not completed components
+    on_stack = set()
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(fun_graph(root)))]
+        while work:
+            node, successors = work[-1]
+            for next_node in successors:
+                if next_node not in index:
+                    index[next_node] = low[next_node] = len(index)
+                    stack.append(next_node)
+                    on_stack.add(next_node)
+                    work.append((next_node, iter(fun_graph(next_node))))
+                    break
+                if next_node in on_stack:
+                    low[node] = min(low[node], index[next_node])
+            else:
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] != index[node]:
+                    continue
+                # node is root of component: pop it and propagate maximum of component and its successors
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                value = max(fun_value(member) for member in component)
+                for member in component:
+                    for next_node in fun_graph(member):
+                        if next_node in best and best[next_node] > value:
+                            value = best[next_node]
+                for member in component:
+                    best[member] = value
+    return best
 
 
 def argsort(dictionary):
@@ -77,6 +180,23 @@ def argsort(dictionary):
     return name_value
 
 
+def latency_percentiles(latencies):
+    """
+    Latency percentiles
+
+    :param latencies: list of floats, seconds
+    :return: dict {'p50': , 'p90': , 'p99': , 'max': } in milliseconds
+
+    >>> latency_percentiles([0.001, 0.002, 0.003])['p50']
+    2.0
+    """
+    if len(latencies) < 2:
+        latencies = latencies * 2 or [0.0, 0.0]
+    q = quantiles(latencies, n=100, method='inclusive')
+    return {name: round(value * 1000, 4) for name, value in (
+        ('p50', q[49]), ('p90', q[89]), ('p99', q[98]), ('max', max(latencies)))}
+
+
 # Task specific functions
 
 class PersonRobbingError(Exception):
@@ -84,6 +204,521 @@ class PersonRobbingError(Exception):
        self.message = msg
 
 
+class Instrumentation:
+    """
+    Counters of work done and time of phases of World operations with optional tracing callbacks
+
+    Counters (int) and times (float, seconds) are named:
+        bfs_nodes_<group> - nodes expanded by exchange paths search of EOCA
+        paths_<group> - exchange (augmenting) paths applied by EOCA (i.e. EOCA cycles)
+        path_transfers_<group> - objects reassigned along exchange paths
+        pulled_<group> - objects taken by new person directly from richer persons (see Group.pull_objects)
+        transfers_<group> - objects which owner changed in operation by new owner group ('free' if not owned)
+        displaced - objects taken away from LOWPRIO persons by normal person
+        time_<phase> - time of phase: assign_free, displace, fair_share, redistribute, active_domains,
+            even_out.
+            Note: time_active_domains is included in time of phase in which active domains were calculated
+        time - total time of operation
+
+    Attributes
+    ----------
+    operation: dict, {name: value} counters and times of current (or last) operation
+    operation_name: str, name of current (or last) operation
+    totals: dict, {name: value} sums of counters and times of all operations
+    n_operations: int, number of operations finished
+    callbacks: list of function(event, data) called on events:
+        'begin' - operation begins, data: {'operation': name}
+        'path' - exchange path applied, data: {'group': group name, 'path': list of (o, previous owner)}
+        'end' - operation ends, data: operation attribute with added 'operation': name item
+    """
+
+    def __init__(self, callbacks=()):
+        """
+        :param callbacks: iterable of tracing functions(event, data) (see class description)
+        """
+        self.callbacks = list(callbacks)
+        self.operation = {}
+        self.operation_name = None
+        self.totals = {}
+        self.n_operations = 0
+        self._t_start = None
+
+    def count(self, name, n=1):
+        """
+        Increase counter of current operation
+        :param name: counter name
+        :param n: number (or seconds) to add
+        """
+        self.operation[name] = self.operation.get(name, 0) + n
+
+    def counting(self, fun, name):
+        """
+        Wrap function to count its calls
+        :param fun: function to wrap
+        :param name: counter name
+        :return: wrapped function
+        """
+        def counting_fun(*args):
+            self.operation[name] = self.operation.get(name, 0) + 1
+            return fun(*args)
+        return counting_fun
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager that adds its execution time to 'time_<name>' counter
+        """
+        t_start = perf_counter()
+        try:
+            yield
+        finally:
+            self.count('time_' + name, perf_counter() - t_start)
+
+    def emit(self, event, data):
+        """ Call tracing callbacks """
+        for callback in self.callbacks:
+            callback(event, data)
+
+    def begin(self, operation_name):
+        """ Start counting of new operation """
+        self.operation = {}
+        self.operation_name = operation_name
+        self._t_start = perf_counter()
+        if self.callbacks:
+            self.emit('begin', {'operation': operation_name})
+
+    def end(self):
+        """ Finish counting of operation and add its counters to totals """
+        self.operation['time'] = perf_counter() - self._t_start
+        for name, value in self.operation.items():
+            self.totals[name] = self.totals.get(name, 0) + value
+        self.n_operations += 1
+        if self.callbacks:
+            self.emit('end', {'operation': self.operation_name, **self.operation})
+
+
+class Metrics:
+    """
+    Latency histograms of World operations and fairness gauges exported in Prometheus text format
+
+    Recording of operation costs one bisect of fixed buckets list, so it can be always on.
+    Gauges are calculated from World on export only, or while background export is started at end of first
+    operation after each export (snapshot for export thread).
+
+    Attributes
+    ----------
+    buckets: tuple of floats, upper bounds of latency buckets, seconds
+    histograms: dict, {operation name: [list of counts in buckets (last is +Inf bucket), sum of latencies]}
+    prefix: str, metrics names prefix
+    snapshot: (histograms, gauges) copied by World for background export, None if not started
+    export_error: exception of last background export or None
+    """
+
+    default_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=default_buckets, prefix='joint_ownership'):
+        """
+        :param buckets: sorted upper bounds of latency buckets, seconds
+        :param prefix: metrics names prefix
+        """
+        self.buckets = tuple(buckets)
+        self.histograms = {}
+        self.prefix = prefix
+        self.snapshot = None
+        self.export_error = None
+        self._timer = None
+        self._session = None    # token of current periodic export
+        self._snapshot_requested = False  # set by export thread to get fresh snapshot at end of next operation
+        self._lock = threading.Lock()
+
+    def observe(self, operation, seconds):
+        """
+        Record operation latency
+        :param operation: operation name
+        :param seconds: latency
+        """
+        try:
+            histogram = self.histograms[operation]
+        except KeyError:
+            histogram = self.histograms[operation] = [[0] * (len(self.buckets) + 1), 0.0]
+        histogram[0][bisect_left(self.buckets, seconds)] += 1
+        histogram[1] += seconds
+
+    def gauges(self, world):
+        """
+        Fairness gauges of the world. Call from thread changing the world
+        :param world: :obj:World
+        :return: dict {gauge name: value or dict {group name: value}}
+        """
+        spreads = {}
+        for name, gr in world.groups.items():
+            capitals = gr.capitals.values()
+            spreads[name] = max(capitals) - min(capitals) if capitals else 0
+        return {'capital_spread': spreads,
+                'persons': {name: len(gr.persons) for name, gr in world.groups.items()},
+                'free_objects': world.n_free,
+                'balanced': int(world.balanced),
+                'transfers_total': world.n_transfers}
+
+    def take_snapshot(self, world):
+        """
+        Copy histograms and gauges of the world for background export if it is started and export thread
+        requested it (see start_export()), so gauges are calculated at most once per export interval.
+        Called by World at end of each operation i.e. by thread changing the world
+        :param world: :obj:World
+        """
+        if self._session is not None and self._snapshot_requested:
+            self._snapshot_requested = False
+            self.snapshot = ({operation: [list(counts), seconds_sum]
+                              for operation, (counts, seconds_sum) in self.histograms.items()},
+                             self.gauges(world))
+
+    def to_prometheus(self, world=None):
+        """
+        Metrics in Prometheus text exposition format
+        :param world: :obj:World to calculate gauges, None - only histograms
+        :return: str
+        """
+        return self.format(self.histograms, None if world is None else self.gauges(world))
+
+    def format(self, histograms, gauges=None):
+        """
+        Format metrics in Prometheus text exposition format
+        :param histograms: dict, see histograms attribute
+        :param gauges: dict, see gauges(), None - only histograms
+        :return: str
+        """
+        p = self.prefix
+        lines = [f'# HELP {p}_operation_seconds Latency of World operations',
+                 f'# TYPE {p}_operation_seconds histogram']
+        for operation, (counts, seconds_sum) in histograms.items():
+            n = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                n += count
+                lines.append(f'{p}_operation_seconds_bucket{{operation="{operation}",le="{bound}"}} {n}')
+            lines.append(f'{p}_operation_seconds_sum{{operation="{operation}"}} {seconds_sum}')
+            lines.append(f'{p}_operation_seconds_count{{operation="{operation}"}} {n}')
+        if gauges is not None:
+            lines += [f'# HELP {p}_capital_spread Difference of max and min capitals of persons in group',
+                      f'# TYPE {p}_capital_spread gauge']
+            lines += [f'{p}_capital_spread{{group="{name}"}} {spread}'
+                      for name, spread in gauges['capital_spread'].items()]
+            lines += [f'# HELP {p}_persons Number of persons in group',
+                      f'# TYPE {p}_persons gauge']
+            lines += [f'{p}_persons{{group="{name}"}} {n}' for name, n in gauges['persons'].items()]
+            lines += [f'# HELP {p}_free_objects Number of objects without owner',
+                      f'# TYPE {p}_free_objects gauge',
+                      f'{p}_free_objects {gauges["free_objects"]}',
+                      f'# HELP {p}_balanced 1 if no evening out of capitals is pending else 0',
+                      f'# TYPE {p}_balanced gauge',
+                      f'{p}_balanced {gauges["balanced"]}',
+                      f'# HELP {p}_transfers_total Number of objects owners changes',
+                      f'# TYPE {p}_transfers_total counter',
+                      f'{p}_transfers_total {gauges["transfers_total"]}']
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _write_text(path, text):
+        """ Write text to file atomically """
+        path_temp = f'{path}.{os.getpid()}.tmp'
+        with open(path_temp, 'w') as f:
+            f.write(text)
+        os.replace(path_temp, path)
+
+    @staticmethod
+    def _send_text(address, text):
+        """ Send text to local socket """
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.connect(address)
+            sock.sendall(text.encode())
+
+    def write_textfile(self, path, world=None):
+        """
+        Write metrics to file atomically (for example for node_exporter textfile collector)
+        :param path: file path
+        :param world: :obj:World to calculate gauges
+        """
+        self._write_text(path, self.to_prometheus(world))
+
+    def send(self, address, world=None):
+        """
+        Send metrics to local socket
+        :param address: str - path of Unix socket, tuple (host, port) - TCP socket
+        :param world: :obj:World to calculate gauges
+        """
+        self._send_text(address, self.to_prometheus(world))
+
+    def start_export(self, world, interval=15.0, path=None, address=None):
+        """
+        Periodically write metrics to file and/or send them to socket in background daemon thread
+
+        Background thread exports snapshot of metrics taken by World (see take_snapshot()), so it never reads
+        the world while it is changed. After each export it requests new snapshot which World takes at end of
+        next operation, so exported metrics may lag behind by up to one interval. Export errors are kept in
+        export_error attribute and do not stop export.
+        :param world: :obj:World to calculate gauges. Call from thread changing the world
+        :param interval: export period, seconds
+        :param path: file path (see write_textfile())
+        :param address: socket address (see send())
+        """
+        def export():
+            try:
+                text = self.format(*self.snapshot)
+                if path is not None:
+                    self._write_text(path, text)
+                if address is not None:
+                    self._send_text(address, text)
+            except Exception as e:  # receiver is not ready or other problem: try next time
+                self.export_error = e
+            else:
+                self.export_error = None
+            finally:
+                self._snapshot_requested = True
+                with self._lock:
+                    if self._session is session:  # not stopped or restarted meanwhile
+                        self._timer = threading.Timer(interval, export)
+                        self._timer.daemon = True
+                        self._timer.start()
+
+        self.stop_export()
+        session = self._session = object()
+        self._snapshot_requested = True
+        self.take_snapshot(world)
+        export()
+
+    def stop_export(self):
+        """ Stop periodic export started by start_export() """
+        with self._lock:
+            self._session = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self.snapshot = None
+        self._snapshot_requested = False
+
+
+class SharedOwnership:
+    """
+    Owners of objects kept in named shared memory segment for zero-copy readers in other processes
+
+    Segment layout (native byte order): header of 4 uint64: sequence, number of objects, capacity, reserved,
+    then int64 owner per object: person name or -1 if object is free. So persons names must be ints >= 0.
+    Sequence is incremented before and after each update (seqlock): it is odd while segment is written, and
+    reader repeats reading until it gets same even sequence before and after read (see OwnershipReader).
+    Only one process (holding World) must write.
+
+    Attributes
+    ----------
+    name: str, name of shared memory segment to pass to readers
+    capacity: int, maximum number of objects
+    """
+    header_size = 32
+    free = -1
+    created = set()  # names of segments created by this process and not unlinked yet
+
+    def __init__(self, capacity, name=None):
+        """
+        Create shared memory segment with all objects free
+        :param capacity: maximum number of objects
+        :param name: name of segment, None - generate unique name
+        """
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=self.header_size + 8 * max(capacity, 1))
+        self.name = self._shm.name
+        self.created.add(self.name)
+        self.capacity = capacity
+        self._header = self._shm.buf[:self.header_size].cast('Q')
+        self._owners = self._shm.buf[self.header_size:self.header_size + 8 * capacity].cast('q')
+        self._header[2] = capacity
+        self._owners[:] = array('q', [self.free]) * capacity
+
+    def write(self, owners, n_objects):
+        """
+        Update owners of objects
+
+        :param owners: dict {o: owner name or None} of changed objects
+        :param n_objects: number of objects
+        """
+        if n_objects > self.capacity:
+            raise ValueError(f'number of objects {n_objects} exceeds shared memory capacity {self.capacity}')
+        header, owners_buf, free = self._header, self._owners, self.free
+        header[0] += 1  # odd: writing
+        for o, owner in owners.items():
+            owners_buf[o] = free if owner is None else owner
+        header[1] = n_objects
+        header[0] += 1  # even: consistent
+
+    def close(self, unlink=True):
+        """
+        Detach segment
+        :param unlink: destroy segment (readers keep their mappings until they close them)
+        """
+        self._header.release()
+        self._owners.release()
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+            self.created.discard(self.name)
+
+
+class OwnershipReader:
+    """
+    Reader of owners of objects from shared memory segment of SharedOwnership in any process
+
+    Lookups read segment directly (no copies and no IPC) retrying if writer updated segment meanwhile.
+    Can be used as context manager to close segment.
+
+    >>> with OwnershipReader(world.shared.name) as reader:  # doctest: +SKIP
+    ...     reader.owner(3)
+    """
+
+    def __init__(self, name):
+        """
+        :param name: name of segment (SharedOwnership.name)
+        """
+        if name in SharedOwnership.created:  # reader in writer's process: segment is tracked by writer
+            self._shm = shared_memory.SharedMemory(name=name)
+        else:
+            # Segment is owned by writer: prevent its destroying by resource tracker at reader exit
+            try:
+                self._shm = shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+            except TypeError:
+                self._shm = shared_memory.SharedMemory(name=name)
+                resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self._header = self._shm.buf[:SharedOwnership.header_size].cast('Q')
+        capacity = self._header[2]
+        self._owners = self._shm.buf[SharedOwnership.header_size:SharedOwnership.header_size + 8 * capacity].cast('q')
+
+    def _read(self, fun):
+        """ Call fun() until it is not overlapped with write """
+        header = self._header
+        while True:
+            sequence = header[0]
+            if sequence & 1:
+                continue  # writer is updating
+            result = fun()
+            if header[0] == sequence:
+                return result
+
+    @property
+    def n_objects(self):
+        return self._header[1]
+
+    @property
+    def sequence(self):
+        """ Sequence counter: changes after each update of segment """
+        return self._header[0]
+
+    def owner(self, o):
+        """
+        Owner of object
+        :param o: object
+        :return: int, owner name or None if object is free
+        """
+        if not 0 <= o < self.n_objects:
+            raise IndexError(f'object {o} is out of range')
+        owner = self._read(lambda: self._owners[o])
+        return None if owner == SharedOwnership.free else owner
+
+    def owners(self):
+        """
+        Consistent snapshot of owners of all objects
+        :return: list of ints or None (same as World.owner_of_o)
+        """
+        owners = self._read(lambda: self._owners[:self._header[1]].tolist())
+        return [None if owner == SharedOwnership.free else owner for owner in owners]
+
+    def close(self):
+        self._header.release()
+        self._owners.release()
+        self._shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Person:
+    """
+    Record of person's state
+
+    Attributes
+    ----------
+    name: str or int, name/ID of person
+    domain: set, possible objects to own (active domain for LOWPRIO persons)
+    domain_given: set, domain given to person. Same as domain for normal persons
+    capital: int, number of owned objects
+    objects: set, owned objects
+    group: :obj:Group, group of person
+    """
+    __slots__ = ('name', 'domain', 'domain_given', 'capital', 'objects', 'group')
+
+    def __init__(self, name, domain, group, domain_given=None):
+        self.name = name
+        self.domain = set(domain)  # copy: domains of records are changed only by replacing them
+        self.domain_given = self.domain if domain_given is None else set(domain_given)
+        self.capital = 0
+        self.objects = set()
+        self.group = group
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.name!r}, capital={self.capital})'
+
+
+class PersonsView(Mapping):
+    """
+    Read only mapping {person_name: attribute of person's record} over dict of Person records
+    """
+    __slots__ = ('_persons', '_attribute')
+
+    def __init__(self, persons, attribute):
+        """
+        :param persons: dict {person_name: :obj:Person}
+        :param attribute: str, attribute of Person to get
+        """
+        self._persons = persons
+        self._attribute = attribute
+
+    def __getitem__(self, person):
+        return getattr(self._persons[person], self._attribute)
+
+    def __contains__(self, person):
+        return person in self._persons
+
+    def __iter__(self):
+        return iter(self._persons)
+
+    def __len__(self):
+        return len(self._persons)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class SetsUnion:
+    """
+    Read only view of union of sets for fast membership checks without building union
+    """
+    __slots__ = ('sets',)
+
+    def __init__(self, *sets):
+        self.sets = sets
+
+    def __contains__(self, item):
+        return any(item in s for s in self.sets)
+
+    def __iter__(self):
+        return iter(set().union(*self.sets))
+
+    def __len__(self):
+        return len(set().union(*self.sets))
+
+    def __repr__(self):
+        return f'{type(self).__name__}{self.sets!r}'
+
+
 class Group:
     """
     Class for persons of normal priority group
@@ -93,31 +728,80 @@ class Group:
     owner_of_o: list of str or ints
         list of person_names who owns objects. Class variable i.e. shared between groups.
         Note: Target is to even out this distribution.
-    domains: dict of sets
-        {person_name: {possible objects}} - all person's domains of group
+    o_free: set
+        Index of free objects (which owner in owner_of_o is None) kept by assign_o_to/take_away_o to get them
+        without scanning owner_of_o. Class variable i.e. shared between groups.
+        Note: reset owner_of_o together with o_free by reset_objects()
+    persons: dict of :obj:Person
+        {person_name: person's record} - all persons of group
+    domains: mapping of sets
+        {person_name: {possible objects}} - all person's domains of group (read-only view of persons records)
             person_name: str or int, name/ID of person
             {possible objects}: set of ints, possible objects to own
-    capitals: dict of ints
-        {person_name: capital} - all person's capitals in group
+    capitals: mapping of ints
+        {person_name: capital} - all person's capitals in group (read-only view of persons records)
         person_name: str or int, name/ID of person
         capital: sum of owned objects
     need_even_out: bool
         Call to even_out method is needed to distribute ownership evenly
     domain_union: set
         Overall group domain
+    domain_counts: dict
+        {o: number of persons of group which (given) domain contains o} - to update union of domains
+        by changed objects only
+    n_cycles: int
+        Number of EOCA cycles (applied exchange paths) performed by even_out since group creation
+    tolerance: int
+        Allowed spread of capitals: even_out stops when capitals of any possible donor and acceptor
+        differ by at most tolerance. 1 (default) - most fair distribution
+    o_owner_before: dict
+        {o: owner} - owners of objects before current operation for objects which were reassigned
+        during operation. Class variable i.e. shared between groups. Reset it to start new operation.
+    name: str
+        Name of group used in instrumentation counters
+    instruments: :obj:Instrumentation or None
+        Counters of work done by group methods. None - counting is disabled
     """
 
     owner_of_o = []                 # target property
+    o_free = set()
+    o_owner_before = {}
 
-    def __init__(self):
+    def __init__(self, tolerance=1, name='normal'):
         """
         Initialisation of empty group's properties
+
+        :param tolerance: int >= 1, allowed spread of capitals (see class description)
+        :param name: name of group
         """
+        if tolerance < 1:
+            raise ValueError('tolerance must be >= 1')
+        self.tolerance = tolerance
+        self.name = name
+        self.instruments = None
         self.lowprio = False
-        self.domains = {}  # :
-        self.capitals = {}  #
+        self.persons = {}
         self.need_even_out = False  # ownership equality is not was broken
         self.domain_union = set()
+        self.domain_counts = {}
+        self.n_cycles = 0
+
+    @classmethod
+    def reset_objects(cls, number_of_objects):
+        """
+        Set all objects free: reset owner_of_o and o_free shared by groups
+        :param number_of_objects: number of objects
+        """
+        cls.owner_of_o = [None] * number_of_objects
+        cls.o_free = set(range(number_of_objects))
+
+    @property
+    def domains(self):
+        return PersonsView(self.persons, 'domain')
+
+    @property
+    def capitals(self):
+        return PersonsView(self.persons, 'capital')
 
     def free_objects_to_person(self, person):
         """
@@ -126,19 +810,66 @@ class Group:
         :return: set, assigned objects
         """
 
-        o_assigned = set()
-        for o in self.domains[person]:
-            if self.owner_of_o[o] is None:
-                self.assign_o_to(o, person)
-                o_assigned.add(o)
+        o_assigned = self.o_free.intersection(self.persons[person].domain)
+        for o in o_assigned:
+            self.assign_o_to(o, person)
         return o_assigned
 
+    def _count_domain(self, person, objects, increment=1):
+        """
+        Update domain_counts by objects added to (increment=1) or removed from (increment=-1) some domain
+
+        :param person: name of person which (given) domain is changed
+        :param objects: collection of objects
+        :param increment: 1 or -1
+        :return: list of objects which appeared in (or disappeared from) union of domains
+        """
+        counts = self.domain_counts
+        changed = []
+        for o in objects:
+            n = counts.get(o, 0) + increment
+            if n:
+                counts[o] = n
+                if n == 1 and increment == 1:
+                    changed.append(o)
+            else:
+                del counts[o]
+                changed.append(o)
+        return changed
+
+    def _union_add(self, objects):
+        """ Add objects appeared in domains of group to union of domains """
+        self.domain_union.update(objects)
+
+    def _union_discard(self, objects):
+        """ Delete objects disappeared from domains of group from union of domains """
+        self.domain_union.difference_update(objects)
+
+    def _put_record(self, record):
+        """
+        Put person's record to group (replacing previous record of same person) and update union of domains
+
+        :param record: :obj:Person
+        :return: (o_appeared, o_disappeared): lists of objects which appeared in or disappeared from union
+        """
+        previous = self.persons.get(record.name)
+        o_disappeared = [] if previous is None else self._count_domain(record.name, previous.domain_given, -1)
+        self._union_discard(o_disappeared)
+        o_appeared = self._count_domain(record.name, record.domain_given)
+        self._union_add(o_appeared)
+        self.persons[record.name] = record
+        if o_disappeared and o_appeared:  # record of same person is replaced
+            o_disappeared, o_appeared = (list(set(o_disappeared).difference(o_appeared)),
+                                         list(set(o_appeared).difference(o_disappeared)))
+        return o_appeared, o_disappeared
+
     def add_person(self, person, domain):
         """
         Adding person
 
         Updates domains, domain_union and capitals.
-        Calls notify_dependent_group() function, which can be extended at dependent group initialisation
+        Calls notify_dependent_group() function, which can be extended at dependent group initialisation,
+        if covered_union changed.
         Assign's free objects to person.
         Sets flag that capitals are need to even out
 
@@ -147,10 +878,7 @@ class Group:
         :return: set, previously free objects assigned to person
 
         """
-        self.domains.update({person: domain})
-        self.domain_union.update(domain)
-        self.capitals.update({person: 0})
-        self.notify_dependent_group()
+        self._notify_union_changed(*self._put_record(Person(person, domain, self)))
         self.need_even_out = True
         return self.free_objects_to_person(person)
 
@@ -158,30 +886,158 @@ class Group:
         """
         Removing person, free its owned objects
 
+        Only objects of person's domain are updated in union of domains.
+        Calls notify_dependent_group() if covered_union changed.
+
         :param person: person's name in dict of domains of group
         :return: set, objects become free
         """
         # free person's objects
-        o_get_free = set()
-        for o in self.domains[person]:
-            if self.owner_of_o[o] == person:
-                self.owner_of_o[o] = None
-                o_get_free.add(o)
-
-        del self.domains[person]
-        del self.capitals[person]
+        record = self.persons.pop(person)
+        for o in record.objects:
+            if o not in self.o_owner_before:
+                self.o_owner_before[o] = person
+            self.owner_of_o[o] = None
+        self.o_free.update(record.objects)
         self.need_even_out = True
 
         # update domain_union
-        self.domain_union = set()
-        for domain in self.domains.values():
-            self.domain_union.update(domain)
-        self.notify_dependent_group()
-        return o_get_free
+        o_disappeared = self._count_domain(person, record.domain_given, -1)
+        self._union_discard(o_disappeared)
+        self._notify_union_changed([], o_disappeared)
+        return record.objects
+
+    def update_domain(self, person, domain):
+        """
+        Change domain of person
+
+        Updates domains and domain_union, takes away objects which are out of new domain,
+        assign's free objects of added part of domain to person.
+        Calls notify_dependent_group() if covered_union changed.
+
+        :param person: person's name in dict of domains of group
+        :param domain: set, new possible objects to own
+        :return: (o_assigned, o_get_free):
+            o_assigned: set, previously free objects assigned to person
+            o_get_free: set, objects taken away from person that become free
+        """
+        record = self.persons[person]
+        domain = set(domain)
+        o_removed = record.domain.difference(domain)
+        o_added = domain.difference(record.domain)
+
+        # free person's objects that are out of new domain
+        o_get_free = record.objects.intersection(o_removed)
+        for o in o_get_free:
+            self.take_away_o(o)
+        record.domain = record.domain_given = domain
+        self.need_even_out = True
+
+        # update domain_union only for changed objects
+        o_disappeared = self._count_domain(person, o_removed, -1)
+        o_appeared = self._count_domain(person, o_added)
+        self._union_discard(o_disappeared)
+        self._union_add(o_appeared)
+        self._notify_union_changed(o_appeared, o_disappeared)
+
+        o_assigned = self.o_free.intersection(o_added)
+        for o in o_assigned:
+            self.assign_o_to(o, person)
+        return o_assigned, o_get_free
+
+    def extend_domain(self, person, objects):
+        """
+        Add new (free) objects to domain of person
+
+        Objects are not assigned here. Calls notify_dependent_group() if covered_union changed.
+
+        :param person: person's name in dict of domains of group
+        :param objects: set, objects to add
+        """
+        record = self.persons[person]
+        objects = objects.difference(record.domain_given)
+        if record.domain is record.domain_given:
+            record.domain = record.domain_given = record.domain_given.union(objects)
+        else:
+            record.domain_given = record.domain_given.union(objects)
+        o_appeared = self._count_domain(person, objects)
+        self._union_add(o_appeared)
+        self._notify_union_changed(o_appeared, [])
+        return objects
+
+    def discard_objects(self, objects):
+        """
+        Delete objects from (given and active) domains of all persons of group
+
+        Objects must be free (see take_away_o).
+
+        :param objects: set, objects to delete
+        :return: dict {person: objects deleted from person's (given) domain}
+        """
+        o_deleted = {}
+        for record in self.persons.values():
+            o_of_person = record.domain_given.intersection(objects)
+            if not o_of_person:
+                continue
+            o_deleted[record.name] = o_of_person
+            if record.domain is record.domain_given:
+                record.domain = record.domain_given = record.domain_given.difference(o_of_person)
+            else:
+                record.domain = record.domain.difference(o_of_person)
+                record.domain_given = record.domain_given.difference(o_of_person)
+        for o in objects:
+            self.domain_counts.pop(o, None)
+        self._union_discard(objects)
+        return o_deleted
+
+    def restore_person(self, record):
+        """
+        Put back record of removed person without objects (to roll back removal, see World.transaction())
+
+        :param record: :obj:Person, record removed by remove_person()
+        """
+        record.capital = 0
+        record.objects = set()
+        self._notify_union_changed(*self._put_record(record))
+        self.need_even_out = True
 
-    def notify_dependent_group(self):
+    def replace_domain(self, person, domain_given):
         """
-        For reassigning on initialisation of dependent group. Called when list of persons of this group changed
+        Replace domain of person without changing ownership (to roll back changes of domains)
+
+        Only union of domains is updated by changed objects. Person must not own objects out of new domain.
+
+        :param person: person's name in dict of domains of group
+        :param domain_given: set, new possible objects to own
+        """
+        record = self.persons[person]
+        o_disappeared = self._count_domain(person, record.domain_given.difference(domain_given), -1)
+        o_appeared = self._count_domain(person, domain_given.difference(record.domain_given))
+        self._union_discard(o_disappeared)
+        self._union_add(o_appeared)
+        record.domain = record.domain_given = domain_given
+        self.need_even_out = True
+        self._notify_union_changed(o_appeared, o_disappeared)
+
+    @property
+    def covered_union(self):
+        """ Objects of domains of this and higher priority groups: lower priority groups can not own them """
+        return self.domain_union
+
+    def _notify_union_changed(self, o_appeared, o_disappeared):
+        """
+        Call notify_dependent_group() if covered_union changed because of changes of union of domains
+        :param o_appeared: objects appeared in union of (given) domains
+        :param o_disappeared: objects disappeared from union of (given) domains
+        """
+        if o_appeared or o_disappeared:
+            self.notify_dependent_group(o_appeared, o_disappeared)
+
+    def notify_dependent_group(self, o_covered=(), o_uncovered=()):
+        """
+        For reassigning on initialisation of dependent group. Called when covered_union of this group changed
+        :param o_covered: objects appeared in covered_union
+        :param o_uncovered: objects disappeared from covered_union
         """
         pass
 
@@ -202,8 +1058,13 @@ class Group:
         if self.owner_of_o[o] is not None:
             raise(PersonRobbingError())
 
+        if o not in self.o_owner_before:
+            self.o_owner_before[o] = None
         self.owner_of_o[o] = person
-        self.capitals[person] += 1
+        self.o_free.discard(o)
+        record = self.persons[person]
+        record.capital += 1
+        record.objects.add(o)
         self.need_even_out = True  # mark that this action may brake ownership equality
 
     def take_away_o(self, o):
@@ -215,12 +1076,17 @@ class Group:
         :param o: object
         """
         person = self.owner_of_o[o]
-        self.capitals[person] -= 1
+        if o not in self.o_owner_before:
+            self.o_owner_before[o] = person
+        record = self.persons[person]
+        record.capital -= 1
+        record.objects.discard(o)
         self.owner_of_o[o] = None
+        self.o_free.add(o)
         self.need_even_out = True
         return person
 
-    def even_out(self):
+    def even_out(self, max_cycles=None, deadline=None):
         """
         Evenly distribute objects between persons of group
 
@@ -232,39 +1098,62 @@ class Group:
 
         As result owner_of_o must have lower variance or nothing must be done
 
+        :param max_cycles: int or None, maximum number of EOCA cycles to perform. None - no limit
+        :param deadline: float or None, time.perf_counter() value after which no new cycles are started
+        :return: bool, True if distribution is evened out, False if budget exceeded. In last case
+            need_even_out flag stays set and next call will resume evening out
+
         Note: All objects must have been assigned already some way because free objects are not considered
         """
         if not self.need_even_out:
-            return
+            return True
+        n_cycles_end = None if max_cycles is None else self.n_cycles + max_cycles
+        persons = self.persons
+        instruments = self.instruments
+        fun_graph = self.o_can_exchange
+        if instruments is not None:
+            fun_graph = instruments.counting(fun_graph, 'bfs_nodes_' + self.name)
         while True:  # in each cycle assign 1 object
             # 1. Create list of persons sorted by their capital
-            person_capital_sorted = argsort(self.capitals)
+            persons_sorted = sorted(persons.values(), key=attrgetter('capital'))
 
             # 2. For each person in list order (possible acceptor) try to assign any object from possible donors
-            for acceptor, c in person_capital_sorted:
-                # Possible donors capital must be bigger on 2 or more objects than acceptor:
-                if c + 1 >= person_capital_sorted[-1][-1]:
-                    return  # can not even out better
+            for record in persons_sorted:
+                # Possible donors capital must be bigger on tolerance + 1 or more objects than acceptor:
+                c_max = record.capital + self.tolerance
+                if c_max >= persons_sorted[-1].capital:
+                    self.need_even_out = False
+                    return True  # can not even out better
 
                 # Same rule to identify target objects. But as we will construct graph from tuple
                 # nodes (o, owner of o) (see o_can_exchange) to identify target nodes we need function:
                 def o_of_possible_donors(node):
-                    return self.capitals[node[1]] > c + 1
+                    return persons[node[1]].capital > c_max
 
                 # path of objects of different persons who can exchange to some target object:
-                path = shortest_path(self.o_can_exchange, (None, acceptor), o_of_possible_donors)
+                acceptor = record.name
+                path = shortest_path(fun_graph, (None, acceptor), o_of_possible_donors, key=itemgetter(1))
 
                 # 3. If path found then assign objects in accordance with it and go to step 1.
                 if len(path) <= 1:
                     continue  # try other acceptor or return
+                if self.n_cycles == n_cycles_end or (deadline is not None and perf_counter() >= deadline):
+                    return False  # budget is exceeded: leave need_even_out set to resume later
                 for o, o_owner in path[1:]:
                     previous_owner = self.take_away_o(o)
                     assert previous_owner == o_owner
                     self.assign_o_to(o, acceptor)
                     acceptor = previous_owner
+                self.n_cycles += 1
+                if instruments is not None:
+                    instruments.count('paths_' + self.name)
+                    instruments.count('path_transfers_' + self.name, len(path) - 1)
+                    if instruments.callbacks:
+                        instruments.emit('path', {'group': self.name, 'path': path[1:]})
                 break  # need resort capital so restart outer cycle
             else:
-                break  # distribution found
+                self.need_even_out = False
+                return True  # distribution found
 
     def o_can_exchange(self, requested_o_and_requester):
         """
@@ -281,95 +1170,243 @@ class Group:
         The graph used to propagate the exchange of objects from richest to poorest owner.
         """
         requested_o, requester = requested_o_and_requester
-        for o in self.domains[requester]:
-            current_owner = self.owner_of_o[o]
+        owner_of_o = self.owner_of_o
+        for o in self.persons[requester].domain:
+            current_owner = owner_of_o[o]
             if current_owner == requester:
                 continue
             else:
                 yield (o, current_owner)
 
-    def poorest_acceptor(self, o):
+    def distribute_objects(self, objects):
         """
-        Poorest possible owner of o
-        :param o: object
-        :return: poorest possible owner of o if any else None
+        Assign free objects to persons of group at once filling capitals from the poorest (water-filling)
+
+        Persons which domain contains any of objects are kept in min-heap by capital. The poorest one gets
+        its most constrained object (having fewest possible owners) and is pushed back until objects or
+        their possible owners are exhausted, so capitals become as even as domains allow without EOCA.
 
-        Giving to poorest is initial approximation of equality
+        :param objects: iterable of free objects
+        :return: set, objects which have no possible owners in group (stay free)
         """
-        poorest = None
-        min_capital = float('inf')
-        for person, domain in self.domains.items():
-            if o in domain:
-                capital_of_p = self.capitals[person]
-                if min_capital > capital_of_p:
-                    min_capital = capital_of_p
-                    poorest = person
-        return poorest
+        o_left = set(objects)
+        n_owners = {}       # {o: number of possible owners}
+        o_of_person = {}    # {person: objects of its domain in o_left}
+        for record in self.persons.values():
+            o_person = [o for o in record.domain if o in o_left] if len(record.domain) < len(o_left) else \
+                [o for o in o_left if o in record.domain]
+            if o_person:
+                o_of_person[record.name] = o_person
+                for o in o_person:
+                    n_owners[o] = n_owners.get(o, 0) + 1
+        heap = []
+        for i, (person, o_person) in enumerate(o_of_person.items()):
+            o_person.sort(key=n_owners.__getitem__, reverse=True)  # pop() returns most constrained object
+            heap.append((self.persons[person].capital, i, person))
+        heapify(heap)
+        while heap:
+            capital, i, person = heappop(heap)
+            o_person = o_of_person[person]
+            while o_person:
+                o = o_person.pop()
+                if o in o_left:
+                    o_left.discard(o)
+                    self.assign_o_to(o, person)
+                    heappush(heap, (capital + 1, i, person))
+                    break
+        return o_left
+
+    def pull_objects(self, person, max_objects=None, deadline=None):
+        """
+        Take objects from richest persons owning objects of person's domain at once (water-filling from the top)
+
+        Owners are kept in max-heap by capital. Person gets one object of the richest owner while its capital
+        exceeds person's capital by more than tolerance. This makes same transfers as EOCA cycles with direct
+        exchange paths but without sorting and searching paths for each object, so new person gets its share
+        up front and even_out is left with transfers through longer exchange chains only.
+
+        :param person: person's name in group
+        :param max_objects: int or None, maximum number of objects to take. None - no limit
+        :param deadline: float or None, time.perf_counter() value after which no objects are taken
+        :return: list, objects taken to person
+        """
+        record = self.persons[person]
+        o_of_owner = {}     # {owner: its objects in domain of person}
+        for o in record.domain:
+            owner = self.owner_of_o[o]
+            if owner is not None and owner != person and owner in self.persons:
+                o_of_owner.setdefault(owner, []).append(o)
+        heap = [(-self.persons[owner].capital, i, owner) for i, owner in enumerate(o_of_owner)]
+        heapify(heap)
+        o_taken = []
+        while heap and -heap[0][0] > record.capital + self.tolerance and len(o_taken) != max_objects:
+            if deadline is not None and perf_counter() >= deadline:
+                break
+            _, i, owner = heappop(heap)
+            o = o_of_owner[owner].pop()
+            self.take_away_o(o)
+            self.assign_o_to(o, person)
+            o_taken.append(o)
+            if o_of_owner[owner]:
+                heappush(heap, (-self.persons[owner].capital, i, owner))
+        if self.instruments is not None:
+            self.instruments.count('pulled_' + self.name, len(o_taken))
+        return o_taken
 
 
 class GroupLowprio(Group):
     """
     Group with support for active domains and given domains.
 
+    Group depends on higher priority group (normal group), which may be GroupLowprio too, so groups of any
+    number of priority levels (tiers) can be chained.
+
     Attributes
     ----------
-    domains_given: list of sets
+    domains_given: mapping of sets
         {'person name': {possible objects}}
             {possible objects} is domain of possible objects given to person
-    domains: dict of sets:
+    domains: mapping of sets:
         {'person name': {possible objects}}
         {possible objects} here is active domain of objects, which excludes
-        objects of overall normal priority group domain. Active domains are
-        automatically updated after adding/removing persons in normal priority group
-    normal_domain_union: set
-        domain_union of normal priority group
+        objects of overall domains of higher priority groups. Active domains are
+        automatically updated after adding/removing persons in higher priority groups
+    normal_domain_union: set or :obj:SetsUnion
+        covered_union of higher priority group: union of domains of all higher priority groups
     domain_union: set
         Union of all active domains of this group
+    domain_given_union: set
+        Union of all given domains of this group
+    domain_counts: dict
+        {o: number of persons which given domain contains o}
+    domain_holders: dict
+        {o: set of names of persons which given domain contains o} - to update active domains of these persons
+        only when o is covered/uncovered by higher priority groups
 
     Other public attributes are the same as for Group class
         
     """
 
-    def __init__(self, normal_group):
+    def __init__(self, normal_group, tolerance=1, name='lowprio'):
         """
-        :param normal_group: lowprio group persons depends on this normal group
+        :param normal_group: lowprio group persons depends on this higher priority group
+        :param tolerance: allowed spread of capitals (see Group)
+        :param name: name of group
         Attributes
         ----------
 
         """
-        super().__init__()
+        super().__init__(tolerance, name)
         self.lowprio = True                 # ID of this group
-        self.domains_given = {}             # not all objects given will be active domains
         self.domain_given_union = set()
+        self.domain_holders = {}
         self._normal_group = normal_group   # to create normal_domain_union attribute
-        normal_group.notify_dependent_group = self.calculate_active_domains
+        normal_group.notify_dependent_group = self.update_active_domains
+
+    @property
+    def domains_given(self):
+        return PersonsView(self.persons, 'domain_given')
 
     @property
     def normal_domain_union(self):
         """
-        Get reference to domain_union of normal group
+        Get reference to covered_union of higher priority group (domain_union of normal group)
         """
-        return self._normal_group.domain_union
+        return self._normal_group.covered_union
 
-    def calculate_active_domains(self):
+    @property
+    def covered_union(self):
+        """ Objects of given domains of this group and of domains of higher priority groups """
+        return SetsUnion(self.domain_given_union, self.normal_domain_union)
+
+    def active_part(self, objects):
+        """
+        Objects which are not in domains of higher priority groups
+        :param objects: set
+        :return: set
         """
-        Calculate active domains and updates domain_union accordingly
+        normal_domain_union = self.normal_domain_union
+        if isinstance(normal_domain_union, set):
+            return objects.difference(normal_domain_union)
+        return {o for o in objects if o not in normal_domain_union}
 
-        Domains and domain_union are calculated by excluding objects
-        owned by normal priority group from given_domains
+    def update_active_domains(self, o_covered=(), o_uncovered=()):
         """
+        Update active domains and domain_union by changes of domains of higher priority groups
 
-        for name, domain_given in self.domains_given.items():
-            self.domains[name] = domain_given.difference(self.normal_domain_union)
-        self.domain_union = self.domain_given_union.difference(self.normal_domain_union)
-        self.need_even_out = True
+        Only active domains of persons which given domains contain changed objects are changed (found by
+        domain_holders index), so time is proportional to these persons domains changes. Changes of
+        covered_union are passed to lower priority group (cascade stops if nothing changed).
+        Note: objects taken out of active domains are still owned. Caller must take them away.
+
+        :param o_covered: objects appeared in normal_domain_union
+        :param o_uncovered: objects disappeared from normal_domain_union
+        """
+        given_union, holders, persons = self.domain_given_union, self.domain_holders, self.persons
+        covered = [o for o in o_covered if o in given_union]
+        uncovered = [o for o in o_uncovered if o in given_union]
+        if covered or uncovered:
+            with nullcontext() if self.instruments is None else self.instruments.phase('active_domains'):
+                for o in covered:
+                    for person in holders[o]:
+                        persons[person].domain.discard(o)
+                for o in uncovered:
+                    for person in holders[o]:
+                        persons[person].domain.add(o)
+                self.domain_union.difference_update(covered)
+                self.domain_union.update(uncovered)
+            self.need_even_out = True
+        # objects of this group given domains stay covered for lower priority groups
+        Group._notify_union_changed(self, [o for o in o_covered if o not in given_union],
+                                    [o for o in o_uncovered if o not in given_union])
+
+    def _count_domain(self, person, objects, increment=1):
+        """ Update domain_holders index and domain_counts (see Group._count_domain) """
+        holders = self.domain_holders
+        if increment == 1:
+            for o in objects:
+                try:
+                    holders[o].add(person)
+                except KeyError:
+                    holders[o] = {person}
+        else:
+            for o in objects:
+                o_holders = holders[o]
+                o_holders.discard(person)
+                if not o_holders:
+                    del holders[o]
+        return super()._count_domain(person, objects, increment)
+
+    def discard_objects(self, objects):
+        """ Delete objects from domains of all persons and from domain_holders index (see Group) """
+        o_deleted = super().discard_objects(objects)
+        for o in objects:
+            self.domain_holders.pop(o, None)
+        return o_deleted
+
+    def _notify_union_changed(self, o_appeared, o_disappeared):
+        """ Changes of union of given domains change covered_union only out of domains of higher groups """
+        normal_domain_union = self.normal_domain_union
+        super()._notify_union_changed([o for o in o_appeared if o not in normal_domain_union],
+                                      [o for o in o_disappeared if o not in normal_domain_union])
+
+    def _union_add(self, objects):
+        """ Add objects appeared in given domains to given union and (if not normal's) to active union """
+        self.domain_given_union.update(objects)
+        normal_domain_union = self.normal_domain_union
+        self.domain_union.update(o for o in objects if o not in normal_domain_union)
+
+    def _union_discard(self, objects):
+        """ Delete objects disappeared from given domains from given and active unions """
+        self.domain_given_union.difference_update(objects)
+        self.domain_union.difference_update(objects)
 
     def add_person(self, person, domain_given):
         """
         Adding person
 
-        Updates domains_given, domain_given_union
-        Calculate active domains
+        Updates domains_given, domain_given_union, domain_union by objects of person's domain only
+        Calculate active domain of person
         Ather action same as
 
         :param person: string or number - Name of new person. Must not be in lowprio domains
@@ -377,79 +1414,198 @@ class GroupLowprio(Group):
         :return: set, previously free objects assigned to new person
 
         """
-        # Update given domains
-        self.domains_given.update({person: domain_given})
-        self.domain_given_union.update(domain_given)
-
-        # Calculate active domains
-        # Instead cycle in self.calculate_active_domains() here we can use one difference:
-        self.domains[person] = domain_given.difference(self.normal_domain_union)
-        self.domain_union = self.domain_given_union.difference(self.normal_domain_union)
-
+        # Only active domain of new person is calculated, domains of others are not changed:
+        self._notify_union_changed(*self._put_record(Person(person, self.active_part(domain_given), self,
+                                                            domain_given)))
         self.need_even_out = True
-        self.capitals.update({person: 0})
         return self.free_objects_to_person(person)
 
-    def remove_person(self, person):
+    def restore_person(self, record):
+        """ Put back record of removed person calculating its active domain (see Group.restore_person) """
+        record.domain = self.active_part(record.domain_given)
+        super().restore_person(record)
+
+    def replace_domain(self, person, domain_given):
+        """ Replace given domain and active domain of person without changing ownership (see Group) """
+        super().replace_domain(person, domain_given)
+        self.persons[person].domain = self.active_part(domain_given)
+
+    def extend_domain(self, person, objects):
         """
-        Removing person
+        Add new (free) objects to given domain of person and update active domain of person
 
-        Updates domains_given, domain_given_union
-        Updates active domains
-        Assign's free objects to person.
+        :param person: person's name in lowprio domains
+        :param objects: set, objects to add
+        """
+        objects = super().extend_domain(person, objects)
+        record = self.persons[person]
+        record.domain = record.domain.union(self.active_part(objects))
+        return objects
 
-        :param person: string or number - Name of person. Must not be in lowprio domains
-        :return: set, previously free objects assigned to person
+    def update_domain(self, person, domain_given):
+        """
+        Change given domain of person
 
+        Updates domains_given, domain_given_union, active domain of person and domain_union
+        Takes away objects which are out of new active domain, assign's free objects of new active domain
+
+        :param person: string or number - Name of person in lowprio domains
+        :param domain_given: set, new possible objects to own
+        :return: (o_assigned, o_get_free) - see Group.update_domain
+        """
+        record = self.persons[person]
+        domain_given = set(domain_given)
+        o_disappeared = self._count_domain(person, record.domain_given.difference(domain_given), -1)
+        o_appeared = self._count_domain(person, domain_given.difference(record.domain_given))
+        self._union_discard(o_disappeared)
+        self._union_add(o_appeared)
+        record.domain_given = domain_given
+
+        # Update active domains
+        domain = self.active_part(domain_given)
+        o_get_free = record.objects.difference(domain)
+        for o in o_get_free:
+            self.take_away_o(o)
+        record.domain = domain
+        self.need_even_out = True
+        self._notify_union_changed(o_appeared, o_disappeared)
+        return self.free_objects_to_person(person), o_get_free
+
+
+class Transaction:
+    """
+    Journal of changes of the world made after start of transaction to roll them back (see World.transaction())
+
+    Attributes
+    ----------
+    world: :obj:World, world which changes are journaled
+    owners_before: dict
+        {o: owner} - owners of objects at start of transaction for objects which were reassigned (updated
+        from Group.o_owner_before of each operation)
+    undo: list of (function, args) - calls undoing structural changes (persons and domains) in order of changes
+    state: counters of the world and groups at start of transaction
+    active: bool, False after commit or rollback
+    """
+
+    def __init__(self, world, state):
+        self.world = world
+        self.owners_before = {}
+        self.undo = []
+        self.state = state
+        self.active = True
+
+    def journal_owners(self):
+        """ Add owners before current operation of objects which were not reassigned in transaction yet """
+        owners_before = self.owners_before
+        for o, owner in Group.o_owner_before.items():
+            if o not in owners_before:
+                owners_before[o] = owner
+
+    def changed_owners(self):
+        """
+        Objects which owners differ from owners at start of transaction
+        :return: dict {o: (owner before, owner now)}
         """
-        # Update given domains
-        # To update given domains instead of active domains in super().remove_person body we assighn
-        self.domains = self.domains_given
-        self.domain_union = self.domain_given_union
+        self.journal_owners()
+        owner_of_o = self.world.owner_of_o
+        n_objects = len(owner_of_o)
+        return {o: (owner, owner_of_o[o]) for o, owner in self.owners_before.items()
+                if o < n_objects and owner_of_o[o] != owner}
 
-        o_get_free = super().remove_person(person)
+    def commit(self):
+        """ Keep changes: stop journaling """
+        self.active = False
+        self.world._transaction = None
 
-        # Assign obtained values back (if it is reference to new object now) or break referencing (else):
-        self.domains_given = self.domains.copy()
-        self.domain_given_union = self.domain_union.copy()
+    def rollback(self):
+        """ Undo changes made after start of transaction """
+        self.active = False
+        self.world._rollback(self)
 
-        # Calculate active domains
-        self.calculate_active_domains()
+    def __enter__(self):
+        return self
 
-        return o_get_free
+    def __exit__(self, *exc_info):
+        if self.active:
+            self.rollback()
 
 
 class World:
     """
-    World of two groups of persons: 'lowprio' and 'normal'.
+    World of groups of persons of ordered priority levels (tiers): by default 'normal' and 'lowprio'.
 
     Adding/removing persons will automatically even out persons's ownership within groups.
 
     Attributes
     ----------
-    groups: dict of :obj:Group, {'normal': :Group, 'lowprio': :GroupLowprio}
-    'normal' persons will always displace 'lowprio' persons from their objects
+    groups: dict of :obj:Group, {'normal': :Group, 'lowprio': :GroupLowprio} in order of priority
+    'normal' persons will always displace 'lowprio' persons from their objects. Each next group is
+    GroupLowprio depending on previous one, so persons of any group displace persons of all next groups
     n_persons: number of persons in the world
+    persons: dict {person_name: :obj:Person} - registry of records of all persons of the world to find
+        person's group (record.group) in O(1)
     step: person add/remove operations counter in the world
-
+    retired: set of retired objects. Their indexes in owner_of_o are reused by add_objects()
+    max_cycles: int or None, EOCA cycles budget of each operation (None - no limit)
+    Allowed spread of capitals of each group is group's tolerance attribute
+    transfers: int, number of objects which owner is changed by last operation
+    n_transfers: int, number of objects owners changes by all operations
+    instruments: :obj:Instrumentation or None, counters of operations work (None - disabled, default)
+    metrics: :obj:Metrics or None, latency histograms of operations (None - disabled)
+    time_budget: float or None, EOCA time budget of each operation, seconds (None - no limit)
+    shared: :obj:SharedOwnership or None, owners of objects in shared memory for readers in other processes
+        (see share_owners())
+
+    If budget is set then each operation completes mandatory steps (free objects assignment,
+    displacing of LOWPRIO persons) and evens out capitals only within budget. Rest of evening out
+    stays pending (see balanced) and is resumed by next operations or by calling even_out().
     """
 
-    def __init__(self, number_of_objects, persons_flow=None):
+    def __init__(self, number_of_objects, persons_flow=None, max_cycles=None, time_budget=None, tolerance=1,
+                 instruments=None, metrics=True, tiers=('normal', 'lowprio')):
         """
         Groups initialisation and optionally run series of adding/removing persons
 
         :param number_of_objects: number of objects. Determine length of result
         :param persons_flow: list of actions (see persons_flow_step())
+        :param max_cycles: EOCA cycles budget of each operation, None - not limited
+        :param time_budget: EOCA time budget of each operation in seconds, None - not limited
+        :param tolerance: int or dict {group name: int}, allowed spread of capitals in groups (see Group).
+            Values > 1 reduce exchanges for the cost of less fair distribution
+        :param instruments: :obj:Instrumentation to count work of operations, None - not count
+        :param metrics: :obj:Metrics to record operations latency, True (default) - create new Metrics,
+            None or False - not record
+        :param tiers: names of groups in order of decreasing priority
 
         """
+        if not isinstance(tolerance, dict):
+            tolerance = dict.fromkeys(tiers, tolerance)
 
         # Groups of persons:
-        Group.owner_of_o = [None] * number_of_objects
-        self.groups = {'normal': Group()}
-        self.groups['lowprio'] = GroupLowprio(self.groups['normal'])
+        Group.reset_objects(number_of_objects)
+        self.groups = {}
+        group = None
+        for name in tiers:
+            group = Group(tolerance.get(name, 1), name) if group is None else \
+                GroupLowprio(group, tolerance.get(name, 1), name)
+            self.groups[name] = group
+        self.instruments = instruments
+        Group.o_owner_before = {}
 
         self.n_persons = 0          # number of persons in the world
+        self.persons = {}
+        self._next_id = 0           # counter of added persons: next never used auto-name if not taken
+        self._free_ids = []         # stack of auto-names released by removed persons to reuse them first
         self.step = 0
+        self.retired = set()
+        self.max_cycles = max_cycles
+        self.time_budget = time_budget
+        self.transfers = 0
+        self.n_transfers = 0
+        self.metrics = Metrics() if metrics is True else metrics or None
+        self.shared = None
+        self._operation = None  # name and start time of current operation
+        self._transaction = None
         if persons_flow is None:
             print('')               # world created
             return
@@ -462,6 +1618,21 @@ class World:
     def owner_of_o(self):
         return Group.owner_of_o
 
+    @property
+    def n_objects(self):
+        """ Number of objects in the world (excluding retired) """
+        return len(self.owner_of_o) - len(self.retired)
+
+    @property
+    def o_free(self):
+        """ Set of objects without owner (excluding retired). Index shared with groups - do not modify """
+        return Group.o_free
+
+    @property
+    def n_free(self):
+        """ Number of objects without owner (excluding retired) """
+        return len(Group.o_free)
+
     @property
     def owner_of_o_str(self):
         """ Short string representing objects owners distribution by using first letter of names of owners
@@ -470,9 +1641,253 @@ class World:
         """
         return ''.join('-' if o is None else str(o)[0] for o in self.owner_of_o)
 
+    @property
+    def instruments(self):
+        """ Counters of operations work shared with groups, None if counting is disabled """
+        return self._instruments
+
+    @instruments.setter
+    def instruments(self, instruments):
+        self._instruments = instruments
+        for gr in self.groups.values():
+            gr.instruments = instruments
+
+    @property
+    def balanced(self):
+        """ True if no evening out of capitals is pending in any group """
+        return not any(gr.need_even_out for gr in self.groups.values())
+
     def __str__(self):
         return f"{type(self).__name__}:	{self.n_persons} persons. Ownership = {self.owner_of_o_str}"
 
+    def even_out(self, max_cycles=None, time_budget=None):
+        """
+        Update distributions in groups using EOCA within budget shared between groups
+
+        Can be called to resume pending evening out (for example from background task): then it is separate
+        operation which transfers are counted but which is not counted in step
+        :param max_cycles: int or None, maximum number of EOCA cycles, None - not limited
+        :param time_budget: float or None, maximum time in seconds, None - not limited
+        :return: bool, True if all groups are evened out (same as balanced)
+        """
+        standalone = self._operation is None  # called not from operation
+        if standalone:
+            self._begin_operation('even_out')
+        deadline = None if time_budget is None else perf_counter() + time_budget
+        try:
+            for gr in self.groups.values():
+                n_cycles_start = gr.n_cycles
+                if not gr.even_out(max_cycles, deadline):
+                    return False
+                if max_cycles is not None:
+                    max_cycles -= gr.n_cycles - n_cycles_start
+            return True
+        finally:
+            if standalone:
+                self._end_operation(step=False)
+
+    def share_owners(self, name=None, capacity=None):
+        """
+        Keep owners of objects in named shared memory segment for readers in other processes
+
+        Segment is updated at end of each operation by objects which owners changed, so readers
+        (see OwnershipReader) see only states between operations. Persons names must be ints >= 0.
+
+        :param name: name of segment, None - generate unique name
+        :param capacity: maximum number of objects (see add_objects()), None - current number of objects
+        :return: :obj:SharedOwnership, its name attribute is to be passed to readers. Close it when done.
+            Previous segment of the world (if any) is closed and destroyed
+        """
+        for person in self.persons:
+            self._check_shared_name(person)
+        n_objects = len(self.owner_of_o)
+        if capacity is None:
+            capacity = n_objects
+        elif capacity < n_objects:
+            raise ValueError(f'capacity {capacity} is less than number of objects {n_objects}')
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+        self.shared = SharedOwnership(capacity, name)
+        self.shared.write(dict(enumerate(self.owner_of_o)), n_objects)
+        return self.shared
+
+    @staticmethod
+    def _check_shared_name(person):
+        if not (isinstance(person, int) and 0 <= person < 2 ** 63):
+            raise ValueError(f'person name {person!r} is not int >= 0 as required for shared owners')
+
+    def _publish(self):
+        """ Update state for readers in other threads and processes: shared owners and metrics snapshot """
+        self._write_shared()
+        if self.metrics is not None:
+            self.metrics.take_snapshot(self)
+
+    def _write_shared(self):
+        """ Write owners of objects changed by operation to shared memory segment if any """
+        if self.shared is not None:
+            owner_of_o = self.owner_of_o
+            self.shared.write({o: owner_of_o[o] for o in Group.o_owner_before}, len(owner_of_o))
+
+    def transaction(self):
+        """
+        Start transaction: changes of the world are journaled and rolled back on exit unless committed
+
+        For "what-if" runs which are inspected and then undone::
+
+            with world.transaction() as tx:
+                world.add_person(domain={1, 2, 3})
+                changes = tx.changed_owners()
+            # here world is as before transaction (call tx.commit() in "with" block to keep changes)
+
+        Rollback time is proportional to number of reassigned objects and changed domains, not to world size.
+        Metrics, instruments counters and shared memory capacity are not rolled back.
+        :return: :obj:Transaction
+        """
+        if self._transaction is not None:
+            raise RuntimeError('transaction is already started')
+        Group.o_owner_before.clear()  # owners changes are journaled from here
+        self._transaction = Transaction(self, (
+            self.n_persons, self.step, self._next_id, list(self._free_ids), self.transfers, self.n_transfers,
+            [(gr.need_even_out, gr.n_cycles) for gr in self.groups.values()]))
+        return self._transaction
+
+    def _journal(self, undo, *args):
+        """ Journal call undoing structural change if transaction is started """
+        if self._transaction is not None:
+            self._transaction.undo.append((undo, args))
+
+    def _rollback(self, transaction):
+        """
+        Restore state of the world at start of transaction
+
+        Objects reassigned in transaction are set free, structural changes are undone in reverse order,
+        then objects are assigned to their previous owners
+        :param transaction: :obj:Transaction of the world
+        """
+        self._transaction = None
+        transaction.journal_owners()
+        Group.o_owner_before.clear()
+        owner_of_o = self.owner_of_o
+        for o in transaction.owners_before:
+            if owner_of_o[o] is not None:
+                self._group_of(owner_of_o[o]).take_away_o(o)
+        for undo, args in reversed(transaction.undo):
+            undo(*args)
+        for o, owner in transaction.owners_before.items():
+            if owner is not None:
+                self._group_of(owner).assign_o_to(o, owner)
+
+        (self.n_persons, self.step, self._next_id, self._free_ids, self.transfers, self.n_transfers,
+         groups_state) = transaction.state
+        for gr, (need_even_out, n_cycles) in zip(self.groups.values(), groups_state):
+            gr.need_even_out, gr.n_cycles = need_even_out, n_cycles
+        self._publish()
+
+    # Undo of structural changes for rollback. Objects of affected persons are free here
+    def _undo_add_person(self, person):
+        """ Delete added person """
+        self._group_of(person).remove_person(person)
+        del self.persons[person]
+
+    def _undo_remove_person(self, record):
+        """ Put back removed person's record """
+        record.group.restore_person(record)
+        self.persons[record.name] = record
+
+    def _undo_update_domain(self, person, domain_given):
+        """ Set previous (given) domain of person """
+        self._group_of(person).replace_domain(person, domain_given)
+
+    def _undo_extend_domain(self, person, objects):
+        """ Delete objects added to domain of person """
+        group = self._group_of(person)
+        group.replace_domain(person, group.persons[person].domain_given.difference(objects))
+
+    def _undo_discard_objects(self, group, o_deleted):
+        """ Put back objects deleted from domains of persons of group (see Group.discard_objects) """
+        for person, objects in o_deleted.items():
+            group.replace_domain(person, group.persons[person].domain_given.union(objects))
+
+    def _undo_add_objects(self, o_new, n_objects):
+        """ Retire again reused objects and delete appended objects """
+        Group.o_free.difference_update(o_new)
+        self.retired.update(o for o in o_new if o < n_objects)
+        for o in range(n_objects, len(self.owner_of_o)):
+            Group.o_owner_before.pop(o, None)
+        del self.owner_of_o[n_objects:]
+
+    def _undo_retire_objects(self, objects):
+        """ Return retired objects (free) """
+        self.retired.difference_update(objects)
+        Group.o_free.update(objects)
+
+    def verify(self):
+        """
+        Check that distribution is valid and evened out: certificate that EOCA has nothing to improve
+
+        Checks that capitals and owned objects of persons records and index of free objects agree with
+        owner_of_o, that objects are owned only by persons having them in (active) domain, that no object
+        is free while an eligible person exists, and that in residual graph of each group (edge from person to owners of objects of
+        its domain) no person can reach (through exchange chain) other person which capital exceeds its own
+        by more than group's tolerance. Time is linear in sum of domains sizes and number of objects.
+        :return: list of str, found problems. Empty list if distribution is fair
+        """
+        problems = []
+        owner_of_o = self.owner_of_o
+        for gr in self.groups.values():
+            for record in gr.persons.values():
+                if record.capital != len(record.objects):
+                    problems.append(f'{gr.name}: capital {record.capital} of {record.name!r} != '
+                                    f'number of its objects {len(record.objects)}')
+                for o in record.objects:
+                    if owner_of_o[o] != record.name or o not in record.domain:
+                        problems.append(f'{gr.name}: object {o} of {record.name!r} is not in its domain '
+                                        f'or is owned by {owner_of_o[o]!r}')
+
+        n_owned = Counter()
+        for o, owner in enumerate(owner_of_o):
+            if o in self.retired:
+                if owner is not None:
+                    problems.append(f'retired object {o} is owned by {owner!r}')
+                if o in self.o_free:
+                    problems.append(f'retired object {o} is in index of free objects')
+            elif owner is None:
+                if any(o in gr.domain_union for gr in self.groups.values()):
+                    problems.append(f'object {o} is free but has eligible persons')
+                if o not in self.o_free:
+                    problems.append(f'free object {o} is not in index of free objects')
+            elif o in self.o_free:
+                problems.append(f'object {o} of {owner!r} is in index of free objects')
+            elif self._group_of(owner) is None:
+                problems.append(f'object {o} is owned by unknown person {owner!r}')
+            else:
+                n_owned[owner] += 1
+                record = self.persons[owner]
+                if o not in record.objects:
+                    problems.append(f'{record.group.name}: object {o} is owned by {owner!r} but not in its objects')
+        for gr in self.groups.values():
+            for record in gr.persons.values():
+                if record.capital != n_owned[record.name]:
+                    problems.append(f'{gr.name}: capital {record.capital} of {record.name!r} != '
+                                    f'number of objects it owns {n_owned[record.name]}')
+
+        for gr in self.groups.values():
+            persons = gr.persons
+
+            def successors(person):
+                for o in persons[person].domain:
+                    owner = owner_of_o[o]
+                    if owner is not None and owner != person and owner in persons:
+                        yield owner
+
+            reachable = max_reachable(persons, successors, lambda person: persons[person].capital)
+            for record in persons.values():
+                if reachable[record.name] > record.capital + gr.tolerance:
+                    problems.append(f'{gr.name}: exchange chain from {record.name!r} (capital {record.capital}) '
+                                    f'to person of capital {reachable[record.name]}')
+        return problems
+
     def persons_flow_step(self, person_data, person=None):
         """
         Add or remove person according to person_data
@@ -503,45 +1918,273 @@ class World:
         info_str = f'{self.step:02d}. {action}{name}\t{self.owner_of_o_str}\t{person_data}'
         print(info_str)
 
+    def _group_of(self, person):
+        """
+        Group of person
+        :param person: name of person
+        :return: group containing person or None if person is not in the world
+        """
+        record = self.persons.get(person)
+        return None if record is None else record.group
+
+    def _allocate_id(self):
+        """
+        Unique int name for new person: last released by removed person or next never used
+
+        :return: int
+        """
+        while self._free_ids:
+            person = self._free_ids.pop()
+            if person not in self.persons:
+                return person
+        while self._next_id in self.persons:
+            self._next_id += 1
+        self._next_id += 1
+        return self._next_id - 1
+
+    def _phase(self, name):
+        """
+        Context manager to measure time of operation phase if instruments enabled
+        :param name: phase name
+        """
+        return nullcontext() if self._instruments is None else self._instruments.phase(name)
+
+    def _lower_groups(self, group):
+        """
+        Groups of lower priority than group
+        :param group: :obj:Group of the world
+        :return: list of groups in order of priority
+        """
+        groups = list(self.groups.values())
+        return groups[groups.index(group) + 1:]
+
+    def _displace_lowprio(self, o_to_displace, person):
+        """
+        Take away objects from lower priority (LOWPRIO) persons and assign them to person
+        :param o_to_displace: objects of lower priority persons
+        :param person: person of higher priority (normal person)
+        """
+        group = self.persons[person].group
+        with self._phase('displace'):
+            for o in o_to_displace:
+                self._group_of(self.owner_of_o[o]).take_away_o(o)
+                group.assign_o_to(o, person)
+        if self._instruments is not None:
+            self._instruments.count('displaced', len(o_to_displace))
+
+    def _assign_released(self, o_to_assign, previous_group):
+        """
+        Assign free objects released by person of previous_group
+        :param o_to_assign: objects to assign
+        :param previous_group: group of person who released objects
+        """
+        with self._phase('redistribute'):
+            # Assign objects of removed person to
+            # 1. poorest persons of same group with intersected domain
+            o_left = previous_group.distribute_objects(o_to_assign)
+            # 2. - to lower priority (LOWPRIO) persons with intersected domain in order of priority.
+            for group in self._lower_groups(previous_group):
+                if not o_left:
+                    break
+                o_left = group.distribute_objects(o_left)
+
+    def _even_out_operation(self, person=None):
+        """
+        Update distributions in groups using EOCA within operation budget
+
+        :param person: new person to take its share of objects from richer persons of its group first
+            (see Group.pull_objects). Objects taken are counted in EOCA cycles budget
+        """
+        max_cycles, time_budget = self.max_cycles, self.time_budget
+        if person is not None:
+            deadline = None if time_budget is None else perf_counter() + time_budget
+            with self._phase('fair_share'):
+                n_pulled = len(self._group_of(person).pull_objects(person, max_cycles, deadline))
+            if max_cycles is not None:
+                max_cycles -= n_pulled
+            if deadline is not None:
+                time_budget = max(deadline - perf_counter(), 0)
+        with self._phase('even_out'):
+            self.even_out(max_cycles, time_budget)
+
+    def _begin_operation(self, name):
+        """
+        Start tracking of owners changes (see Group.o_owner_before) and instruments counting
+        :param name: operation name
+        """
+        if self._transaction is not None:
+            self._transaction.journal_owners()
+        Group.o_owner_before.clear()
+        if self._instruments is not None:
+            self._instruments.begin(name)
+        self._operation = (name, perf_counter())
+
+    def _end_operation(self, step=True):
+        """
+        Count owners changes of operation and operations
+        :param step: count operation in step, False for operation that is not step of persons flow
+        """
+        owner_of_o = self.owner_of_o
+        self.transfers = sum(owner_of_o[o] != owner for o, owner in Group.o_owner_before.items())
+        self.n_transfers += self.transfers
+        if step:
+            self.step += 1
+        if self._instruments is not None:
+            for o, owner in Group.o_owner_before.items():
+                if owner_of_o[o] != owner:
+                    group = None if owner_of_o[o] is None else self._group_of(owner_of_o[o])
+                    self._instruments.count('transfers_' + ('free' if group is None else group.name))
+            self._instruments.end()
+        if self.metrics is not None:
+            self.metrics.observe(self._operation[0], perf_counter() - self._operation[1])
+        self._operation = None
+        self._publish()
+
     # Actions
     # As of keeping state requirement we need implement only adding and removing 1 person
-    def add_person(self, person=None, domain=set(), lowprio=False):
+    def add_person(self, person=None, domain=None, lowprio=False, tier=None):
         """
         Add person to specified group and even out persons capitals
 
-        :param person: name of person, if None then will be assigned unique int number
-        :param domain: list of possible objects to hold
-        :param lowprio: person will be assigned to low priority group
+        :param person: name of person not in the world (ValueError if it is), if None then will be assigned unique
+            int number
+        :param domain: set of possible objects to hold (copied), None - empty
+        :param lowprio: person will be assigned to low priority group (of lowest priority)
+        :param tier: name of group to add person to (overrides lowprio). None - first group (normal) or
+            last group if lowprio
         :return: int or str, name of person (unique int name generated if person=None)
         """
 
         if person is None:
             # Auto-name
-            person = self.n_persons
-            while person in self.groups['normal'].domains or person in self.groups['lowprio'].domains:
-                person -= 1
-
-        group = self.groups['lowprio' if lowprio else 'normal']
-        if not lowprio:
-            # lowprio objects that we will need to redistribute between normal persons
-            previous_lowprio = domain.intersection(self.groups['lowprio'].domain_union)
+            person = self._allocate_id()
+        else:
+            if person in self.persons:
+                raise ValueError(f'person {person!r} is already in the world')
+            if self.shared is not None:
+                self._check_shared_name(person)
+            self._next_id += 1      # named persons are counted too as in numbering of persons flow
+
+        if domain is None:
+            domain = set()
+        self._begin_operation('add_person')
+        if tier is None:
+            tier = list(self.groups)[-1 if lowprio else 0]
+        group = self.groups[tier]
+        # lowprio objects that we will need to redistribute to new person
+        previous_lowprio = set().union(*(domain.intersection(gr.domain_union) for gr in self._lower_groups(group)))
 
         # 1. This assigns objects that have no owner to new person
-        o_assigned = group.add_person(person, domain)
-        # 2. Assign objects of LOWPRIO persons if new person has normal priority
-        if not lowprio:
-            for o in previous_lowprio.difference(o_assigned):
-                self.groups['lowprio'].take_away_o(o)
-                group.assign_o_to(o, person)
-
-        # 3. Update distributions in affected groups using EOCA
-        for gr in self.groups.values():
-            gr.even_out()
+        with self._phase('assign_free'):
+            o_assigned = group.add_person(person, domain)
+        self.persons[person] = group.persons[person]
+        self._journal(self._undo_add_person, person)
+        # 2. Assign objects of lower priority (LOWPRIO) persons of active domain of new person
+        if previous_lowprio:
+            self._displace_lowprio(previous_lowprio.intersection(self.persons[person].domain).difference(o_assigned),
+                                   person)
+        # 3. Take share of objects from richer persons of same group directly and
+        # 4. Update distributions in affected groups using EOCA
+        self._even_out_operation(person)
 
         self.n_persons += 1
-        self.step += 1
+        self._end_operation()
         return person
 
+    def update_domain(self, person, domain):
+        """
+        Change domain of person and even out persons capitals
+
+        Only added and removed objects of domain are processed: objects out of new domain are
+        reassigned as if person is removed and free objects and (for normal person) objects of
+        LOWPRIO persons from added part of domain are assigned to person.
+
+        :param person: name of person
+        :param domain: set, new possible objects to own
+        """
+        group = self._group_of(person)
+        if group is None:
+            print('Person is not here!')
+            return
+        self._begin_operation('update_domain')
+        # lowprio objects that we will need to redistribute to person
+        o_added = domain.difference(group.domains_given[person] if group.lowprio else group.domains[person])
+        previous_lowprio = set().union(*(o_added.intersection(gr.domain_union) for gr in self._lower_groups(group)))
+
+        self._journal(self._undo_update_domain, person, group.persons[person].domain_given)
+        with self._phase('assign_free'):
+            o_assigned, o_to_assign = group.update_domain(person, domain)
+        if previous_lowprio:
+            self._displace_lowprio(previous_lowprio.intersection(group.domains[person]).difference(o_assigned),
+                                   person)
+        self._assign_released(o_to_assign, group)
+
+        # Update distributions in affected groups using EOCA
+        self._even_out_operation()
+        self._end_operation()
+
+    def add_objects(self, n, rights=None):
+        """
+        Add objects, assign them to poorest possible owners and even out persons capitals
+
+        Indexes of retired objects are reused first, other objects are appended to owner_of_o.
+
+        :param n: number of objects to add
+        :param rights: dict {person: iterable of ints} - persons to which domains new objects are added.
+            Objects are specified by their position (0 to n-1) in added objects list
+        :return: list, added objects
+        """
+        if self.shared is not None and len(self.owner_of_o) + max(n - len(self.retired), 0) > self.shared.capacity:
+            raise ValueError(f'number of objects exceeds shared memory capacity {self.shared.capacity}')
+        rights = {person: list(positions) for person, positions in (rights or {}).items()}
+        for person, positions in rights.items():
+            if person not in self.persons:
+                raise ValueError(f'person {person!r} is not in the world')
+            if not all(isinstance(i, int) and 0 <= i < n for i in positions):
+                raise ValueError(f'positions of objects of {person!r} must be ints in range 0 to {n - 1}')
+        self._begin_operation('add_objects')
+        o_new = sorted(self.retired)[:n]
+        self.retired.difference_update(o_new)
+        n_objects = len(self.owner_of_o)
+        n_append = n - len(o_new)
+        self.owner_of_o.extend([None] * n_append)  # list grows in place with amortized O(1) cost per object
+        o_new.extend(range(n_objects, n_objects + n_append))
+        Group.o_free.update(o_new)
+        self._journal(self._undo_add_objects, o_new, n_objects)
+        for person, positions in rights.items():
+            self._journal(self._undo_extend_domain, person,
+                          self._group_of(person).extend_domain(person, {o_new[i] for i in positions}))
+
+        self._assign_released(o_new, next(iter(self.groups.values())))
+        self._even_out_operation()
+        self._end_operation()
+        return o_new
+
+    def retire_objects(self, objects):
+        """
+        Retire objects: take away them from owners and delete from persons domains, then even out capitals
+
+        :param objects: iterable of ints, objects to retire
+        """
+        objects = set(objects)
+        n_objects = len(self.owner_of_o)
+        if not all(isinstance(o, int) and 0 <= o < n_objects for o in objects):
+            raise ValueError(f'objects to retire must be ints in range 0 to {n_objects - 1}')
+        self._begin_operation('retire_objects')
+        objects.difference_update(self.retired)
+        for o in objects:
+            owner = self.owner_of_o[o]
+            if owner is not None:
+                self._group_of(owner).take_away_o(o)
+        for gr in self.groups.values():
+            self._journal(self._undo_discard_objects, gr, gr.discard_objects(objects))
+        self.retired.update(objects)
+        Group.o_free.difference_update(objects)
+        self._journal(self._undo_retire_objects, objects)
+
+        self._even_out_operation()
+        self._end_operation()
+
     def remove_person(self, person):
         """
         Remove person and even out persons capitals
@@ -550,31 +2193,237 @@ class World:
 
         """
         # find person's group
-        for gr in self.groups.values():
-            if person in gr.domains:
-                previous_group = gr
-                break
-        else:
+        previous_group = self._group_of(person)
+        if previous_group is None:
             print('Person is not here!')
             return
+        self._begin_operation('remove_person')
         o_to_assign = previous_group.remove_person(person)
-
-        for o in o_to_assign:
-            # Assign objects of removed person to
-            # 1. poorest person of same group with intersected domain, i.e. to:
-            acceptor = previous_group.poorest_acceptor(o)
-            if acceptor is None:
-                # 2. - to any LOWPRIO persons with intersected domain if priority of removed person is normal.
-                if not previous_group.lowprio:
-                    acceptor = self.groups['lowprio'].poorest_acceptor(o)
-                    if acceptor is not None:
-                        self.groups['lowprio'].assign_o_to(o, acceptor)
-            else:
-                previous_group.assign_o_to(o, acceptor)
+        self._journal(self._undo_remove_person, self.persons.pop(person))
+        if isinstance(person, int) and person < self._next_id:
+            self._free_ids.append(person)
+        self._assign_released(o_to_assign, previous_group)
 
         # 3. Update distributions in affected groups using EOCA
-        for gr in self.groups.values():
-            gr.even_out()
+        self._even_out_operation()
 
         self.n_persons -= 1
-        self.step += 1
\ No newline at end of file
+        self._end_operation()
+
+
+# Traces of persons flow
+# Events of traces are tuples:
+#    ('add', person, domain, lowprio) - add person with domain (set of objects), lowprio: bool
+#    ('remove', person)               - remove person
+# JSONL trace: optional header line {"objects": number of objects} and line per event:
+#    {"op": "add", "person": person, "domain": [objects], "lowprio": bool} or {"op": "remove", "person": person}
+# Binary trace: header b'JOPT' + uint32 number of objects, record per event: uint8 action code (0 - add normal
+#    person, 1 - add LOWPRIO person, 2 - remove person), uint32 person, for add events also uint32 number of
+#    objects in domain and uint32 objects. All numbers are little-endian. Persons names must be ints.
+trace_magic = b'JOPT'
+
+
+def get_trace_format(path, trace_format=None):
+    """ Format of trace: trace_format if specified else 'bin' for *.bin files else 'jsonl' """
+    if trace_format is not None:
+        return trace_format
+    return 'bin' if path.endswith('.bin') else 'jsonl'
+
+
+def read_trace(path, trace_format=None):
+    """
+    Lazily read events of trace file
+
+    :param path: path of JSONL or binary trace
+    :param trace_format: 'jsonl' or 'bin', None - determine by file extension
+    :return: (n_objects, events):
+        n_objects: number of objects from trace header or None if not specified
+        events: iterator of events
+    """
+    if get_trace_format(path, trace_format) == 'bin':
+        f = open(path, 'rb')
+        if f.read(4) != trace_magic:
+            f.close()
+            raise ValueError(f'{path} is not binary trace')
+        n_objects, = struct.unpack('<I', f.read(4))
+
+        def events():
+            with f:
+                while True:
+                    record = f.read(5)
+                    if not record:
+                        return
+                    code, person = struct.unpack('<BI', record)
+                    if code == 2:
+                        yield 'remove', person
+                    else:
+                        n, = struct.unpack('<I', f.read(4))
+                        yield 'add', person, set(struct.unpack(f'<{n}I', f.read(4 * n))), code == 1
+
+        return n_objects, events()
+
+    f = open(path)
+    line_first = f.readline()
+    header = json.loads(line_first) if line_first.strip() else {}
+    n_objects = header.get('objects')
+
+    def events():
+        with f:
+            lines = chain([line_first], f) if 'op' in header else f
+            for line in lines:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event['op'] == 'add':
+                    yield 'add', event['person'], set(event['domain']), bool(event.get('lowprio', False))
+                else:
+                    yield 'remove', event['person']
+
+    return n_objects, events()
+
+
+def write_trace(path, events, n_objects, trace_format=None):
+    """
+    Write events to trace file
+
+    :param path: path of trace
+    :param events: iterable of events
+    :param n_objects: number of objects to write in header
+    :param trace_format: 'jsonl' or 'bin', None - determine by file extension
+    """
+    if get_trace_format(path, trace_format) == 'bin':
+        with open(path, 'wb') as f:
+            f.write(trace_magic + struct.pack('<I', n_objects))
+            for event in events:
+                if event[0] == 'add':
+                    f.write(struct.pack(f'<BII{len(event[2])}I', int(event[3]), event[1],
+                                        len(event[2]), *sorted(event[2])))
+                else:
+                    f.write(struct.pack('<BI', 2, event[1]))
+        return
+    with open(path, 'w') as f:
+        f.write(json.dumps({'objects': n_objects}) + '\n')
+        for event in events:
+            if event[0] == 'add':
+                f.write(json.dumps({'op': 'add', 'person': event[1], 'domain': sorted(event[2]),
+                                    'lowprio': event[3]}) + '\n')
+            else:
+                f.write(json.dumps({'op': 'remove', 'person': event[1]}) + '\n')
+
+
+def new_world(n_objects, **world_kwargs):
+    """
+    World created without printing (for benchmarks, replay and tests)
+    :param n_objects: number of objects
+    :param world_kwargs: other World arguments
+    :return: :obj:World
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return World(n_objects, **world_kwargs)
+
+
+def apply_event(world, event, tier=None):
+    """
+    Apply event of persons flow trace to the world
+
+    :param world: :obj:World
+    :param event: ('add', person, domain, lowprio) or ('remove', person)
+    :param tier: name of group to add person to (overrides lowprio of event), None - by lowprio of event
+    :return: bool, False if event removes person which is not in the world (event is skipped)
+    """
+    if event[0] == 'add':
+        world.add_person(event[1], event[2], lowprio=event[3], tier=tier)
+    elif event[1] in world.persons:
+        world.remove_person(event[1])
+    else:
+        return False
+    return True
+
+
+def replay(events, n_objects, batch=1, **world_kwargs):
+    """
+    Apply events to new World measuring throughput and latency
+
+    :param events: iterable of events
+    :param n_objects: number of objects
+    :param batch: number of events after which capitals are evened out. If > 1 then operations perform
+        only mandatory steps and EOCA runs once per batch
+    :param world_kwargs: other World arguments
+    :return: (world, report):
+        world: :obj:World after all events
+        report: dict of throughput, latency percentiles (ms) and final fairness. Events removing persons
+            which are not in the world are skipped and counted in 'unknown_persons', events adding persons
+            with objects out of range 0 to n_objects - 1 are skipped and counted in 'invalid_objects'
+    """
+    with contextlib.redirect_stdout(io.StringIO()):  # World messages must not mix with report
+        world = World(n_objects, **world_kwargs)
+        if batch > 1:
+            world.max_cycles = 0
+        latencies = {'add': [], 'remove': [], 'even_out': []}
+        n_events = n_unknown = n_invalid = 0
+        time_start = perf_counter()
+        for event in events:
+            n_events += 1
+            t = perf_counter()
+            if event[0] == 'add' and event[2] and not (0 <= min(event[2]) and max(event[2]) < n_objects):
+                n_invalid += 1
+            elif apply_event(world, event):
+                latencies[event[0]].append(perf_counter() - t)
+            else:
+                n_unknown += 1
+            if batch > 1 and n_events % batch == 0:
+                t = perf_counter()
+                world.even_out()
+                latencies['even_out'].append(perf_counter() - t)
+        if batch > 1 and not world.balanced:
+            t = perf_counter()
+            world.even_out()
+            latencies['even_out'].append(perf_counter() - t)
+        time_all = perf_counter() - time_start
+
+    report = {
+        'events': n_events,
+        'unknown_persons': n_unknown,
+        'invalid_objects': n_invalid,
+        'time': round(time_all, 4),
+        'events_per_second': round(n_events / time_all, 1) if time_all else None,
+        'latency_ms': {name: latency_percentiles(values) for name, values in latencies.items() if values},
+        'capital_spread': {name: max(gr.capitals.values()) - min(gr.capitals.values()) if gr.capitals else 0
+                           for name, gr in world.groups.items()},
+        'persons': world.n_persons,
+        'free_objects': world.n_free,
+        'transfers': world.n_transfers,
+        'balanced': world.balanced,
+    }
+    return world, report
+
+
+def main(argv=None):
+    """
+    Command line interface:
+        python -m joint_ownership_problem replay TRACE [--objects N] [--batch K] ...
+    """
+    parser = argparse.ArgumentParser(prog='python -m joint_ownership_problem',
+                                     description='Joint ownership problem solution using EOCA algorithm')
+    commands = parser.add_subparsers(dest='command', required=True)
+    parser_replay = commands.add_parser(
+        'replay', help='replay persons flow trace and report throughput, latency and final fairness')
+    parser_replay.add_argument('trace', help='JSONL or binary (*.bin) trace file')
+    parser_replay.add_argument('--format', choices=('jsonl', 'bin'), help='trace format, default: by extension')
+    parser_replay.add_argument('--objects', type=int, help='number of objects, default: from trace header')
+    parser_replay.add_argument('--batch', type=int, default=1, help='even out capitals once per BATCH events')
+    parser_replay.add_argument('--tolerance', type=int, default=1, help='allowed spread of capitals')
+    args = parser.parse_args(argv)
+
+    n_objects, events = read_trace(args.trace, args.format)
+    if args.objects is not None:
+        n_objects = args.objects
+    if n_objects is None:
+        parser.error('number of objects is not specified in trace header: use --objects')
+    world, report = replay(events, n_objects, batch=args.batch, tolerance=args.tolerance)
+    json.dump(report, sys.stdout, indent=1)
+    print()
+
+
+if __name__ == '__main__':
+    main()
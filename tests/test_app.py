@@ -1,4 +1,4 @@
-#!/usr/bin/env python3.6
+#!/usr/bin/env python3.8
 # -*- coding: utf-8 -*-
 # c of joint_ownership_problem module
 # Purpose: test for job
@@ -6,6 +6,8 @@
 
 import unittest
 from joint_ownership_problem import *
+from random import Random
+from benchmarks.generators import shapes
 
 
 class MyTestCase(unittest.TestCase):
@@ -69,8 +71,110 @@ class MyTestCase(unittest.TestCase):
                 self.get_capitals(self.World.owner_of_o_str),
                 self.get_capitals(owners))
 
+    def test_generated_flows(self):
+        """
+        Run persons flows of all benchmarks.generators shapes checking that after each operation
+        objects are free only if nobody can own them and LOWPRIO persons own only their active domains
+        """
+        for shape, generator in shapes.items():
+            world = new_world(40)
+            for i, event in enumerate(generator(40, 150, seed=1)):
+                apply_event(world, event)
+
+                msg = f'{shape} flow, event {i}: {event}. '
+                domain_union = set().union(*(gr.domain_union for gr in world.groups.values()))
+                for o, owner in enumerate(world.owner_of_o):
+                    if owner is None:
+                        self.assertNotIn(o, domain_union, msg=msg + f'object {o} is free')
+                for gr in world.groups.values():
+                    self.assertEqual(gr.capitals, {**{p: 0 for p in gr.domains}, **self.get_capitals(
+                        p for o, p in enumerate(world.owner_of_o) if o in gr.domain_union and p in gr.domains)},
+                        msg=msg + 'capitals correspond to owners distribution')
+                    for person, domain in gr.domains.items():
+                        self.assertLessEqual(
+                            {o for o, p in enumerate(world.owner_of_o) if p == person}, domain,
+                            msg=msg + f'person {person} owns only objects of its active domain')
+
+    def test_fuzz_verify(self):
+        """
+        Fuzz persons flows of benchmarks.generators shapes with random seeds, sizes and World options
+        checking by World.verify() certificate that distribution is fair after each operation
+        """
+        rnd = Random(0)
+        for shape, generator in shapes.items():
+            for _ in range(3):
+                seed, n_objects = rnd.randrange(1000), rnd.randrange(5, 60)
+                world_kwargs = {'tolerance': rnd.choice((1, 2))}
+                world = new_world(n_objects, **world_kwargs)
+                for i, event in enumerate(generator(n_objects, 100, seed=seed)):
+                    apply_event(world, event)
+                    self.assertEqual(world.verify(), [], msg=f'{shape} flow, seed {seed}, N={n_objects}, '
+                                                             f'{world_kwargs}, event {i}: {event}')
+
+    def test_fuzz_verify_tiers(self):
+        """
+        Fuzz persons flows of benchmarks.generators shapes adding persons to random of 3 tiers checking
+        World.verify() certificate and that active domains and their holders index are same as calculated from
+        scratch
+        """
+        rnd = Random(1)
+        for shape, generator in shapes.items():
+            seed, n_objects = rnd.randrange(1000), rnd.randrange(5, 60)
+            world = new_world(n_objects, tiers=('gold', 'silver', 'bronze'))
+            for i, event in enumerate(generator(n_objects, 100, seed=seed)):
+                apply_event(world, event, tier=rnd.choice(list(world.groups)))
+                msg = f'{shape} flow, seed {seed}, N={n_objects}, event {i}: {event}'
+                self.assertEqual(world.verify(), [], msg=msg)
+                for gr in list(world.groups.values())[1:]:
+                    for person, domain_given in gr.domains_given.items():
+                        self.assertEqual(gr.domains[person],
+                                         {o for o in domain_given if o not in gr.normal_domain_union}, msg=msg)
+                    holders = {}
+                    for person, domain_given in gr.domains_given.items():
+                        for o in domain_given:
+                            holders.setdefault(o, set()).add(person)
+                    self.assertEqual(gr.domain_holders, holders, msg=msg)
+
+    def test_fuzz_transaction_rollback(self):
+        """
+        Fuzz random changes of the world in transactions checking that rollback restores state exactly
+        """
+        def state(world):
+            return (list(world.owner_of_o), set(world.o_free), set(world.retired), world.n_persons, world.step,
+                    [(set(gr.domain_union), dict(gr.domain_counts), gr.need_even_out,
+                      {o: set(persons) for o, persons in getattr(gr, 'domain_holders', {}).items()},
+                      {p: (set(r.domain), set(r.domain_given), r.capital, set(r.objects)) for p, r in gr.persons.items()})
+                     for gr in world.groups.values()])
+
+        rnd = Random(2)
+        for shape, generator in shapes.items():
+            seed, n_objects = rnd.randrange(1000), rnd.randrange(5, 40)
+            world = new_world(n_objects, tiers=('gold', 'silver', 'bronze'))
+            for i, event in enumerate(generator(n_objects, 60, seed=seed)):
+                apply_event(world, event, tier=rnd.choice(list(world.groups)))
+                if i % 6:
+                    continue
+                before = state(world)
+                with world.transaction():
+                    for _ in range(rnd.randrange(1, 6)):
+                        action = rnd.randrange(5)
+                        objects = [o for o in range(len(world.owner_of_o)) if o not in world.retired]
+                        if action == 0 or not world.persons:
+                            world.add_person(domain=set(rnd.sample(objects, min(len(objects), 5))),
+                                             tier=rnd.choice(list(world.groups)))
+                        elif action == 1:
+                            world.remove_person(rnd.choice(list(world.persons)))
+                        elif action == 2:
+                            world.update_domain(rnd.choice(list(world.persons)),
+                                                set(rnd.sample(objects, min(len(objects), 4))))
+                        elif action == 3:
+                            world.add_objects(3, rights={rnd.choice(list(world.persons)): [0, 2]})
+                        else:
+                            world.retire_objects(rnd.sample(objects, min(len(objects), 2)))
+                self.assertEqual(state(world), before, msg=f'{shape} flow, seed {seed}, event {i}')
+                self.assertEqual(world.verify(), [])
+
     # todo: check for mutually exclusive persons (if more owners than their common domain union)
-    # todo: add random users generator test, check by min possible variance(capitals)
 
 
 # Task statement requires no main!
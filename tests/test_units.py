@@ -1,9 +1,18 @@
-#!/usr/bin/env python3.6
+#!/usr/bin/env python3.8
 # -*- coding: utf-8 -*-
 # Unit tests of joint_ownership_problem module (elements of the "redistribution fairness")
 # Purpose: test for job
 # Copyright (C) 2018 Andrey Korzh <ao.korzh@gmail.com>
 
+import contextlib
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
 from random import choice
 from statistics import variance
@@ -17,6 +26,31 @@ class GeneralFunctionsTest(unittest.TestCase):
             list(bfs_paths(lambda x: (x for x in dd[x]), 'A', lambda x: x == 'F')),
             [['A', 'C', 'F'], ['A', 'B', 'E', 'F']])
 
+    def test_shortest_path(self):
+        dd = {'A': {'B', 'C'}, 'B': {'A', 'D', 'E'}, 'C': {'A', 'F'}, 'D': {'B'}, 'E': {'B', 'F'}, 'F': {'C', 'E'}}
+        self.assertEqual(shortest_path(lambda x: (x for x in dd[x]), 'A', lambda x: x == 'F'), ['A', 'C', 'F'])
+        self.assertEqual(shortest_path(lambda x: (x for x in dd[x]), 'A', lambda x: x == 'G'), [])
+
+    def test_shortest_path_expands_nodes_once(self):
+        """ Search time is linear in graph size even if target is not reachable (no enumeration of paths) """
+        expanded = []
+        nodes = range(12)  # complete graph: number of simple paths is factorial of number of nodes
+
+        def graph(node):
+            expanded.append(node)
+            return (x for x in nodes if x != node)
+
+        self.assertEqual(shortest_path(graph, 0, lambda x: x == 'G'), [])
+        self.assertEqual(sorted(expanded), list(nodes), 'each node is expanded once')
+
+        def graph_labeled(node):  # nodes (label, variant): variants of same label have same joint nodes
+            return [(node[0] + 1, 'b'), (node[0] + 1, 'c')] if node[0] < 3 else []
+
+        self.assertEqual(shortest_path(graph_labeled, (0, 'a'), lambda node: node == (3, 'b'), key=itemgetter(0)),
+                         [(0, 'a'), (1, 'b'), (2, 'b'), (3, 'b')])
+        self.assertEqual(shortest_path(graph_labeled, (0, 'a'), lambda node: node == (3, 'c'), key=itemgetter(0)),
+                         [], 'only first node of same label is checked')
+
 
 def assign_o_to_p(group, objects, person, test_fun=None):
     """
@@ -39,6 +73,17 @@ def assign_o_to_p(group, objects, person, test_fun=None):
             test_fun(group, i, o)
 
 
+def take_away_all(group):
+    """
+    Take away all objects of persons of group so they have zero capitals
+
+    :param group: instance of joint_ownership_problem Group class
+    """
+    for record in group.persons.values():
+        for o in list(record.objects):
+            group.take_away_o(o)
+
+
 def GroupSetUp(self, number_of_objects=10):
     """
     Specify test data of 2 persons needed for test. Create Group instance, assign properties of test data
@@ -48,16 +93,19 @@ def GroupSetUp(self, number_of_objects=10):
     """
     # Groups will have this number_of_objects to distribute between
     self.number_of_objects = number_of_objects
-    Group.owner_of_o = [None] * number_of_objects  # initially free
+    Group.reset_objects(number_of_objects)  # initially free
     # self.owner_of_o = Group.owner_of_o  # copy to check expecting changes of Group.owner_of_o
 
     self.groups = {'normal': Group()}
     # person's data:
     self.domains = {'Vasia': {1, 2, 3, 4, 5},
                     'Pasha': {3, 4, 5, 6}}
-    # Assign person's data:
-    self.groups['normal'].domains = self.domains
-    self.groups['normal'].capitals = {}.fromkeys(self.domains, 0)
+    # Assign person's data: add persons and free objects assigned to them
+    for person, domain in self.domains.items():
+        self.groups['normal'].add_person(person, domain)
+    take_away_all(self.groups['normal'])
+    self.groups['normal'].need_even_out = False
+    Group.o_owner_before = {}
 
 
 class GroupObjectsAssignmentsTest(unittest.TestCase):
@@ -106,6 +154,21 @@ class GroupObjectsAssignmentsTest(unittest.TestCase):
         Group.owner_of_o[o] = 'Vasia'
         self.assertRaises(PersonRobbingError, self.groups['normal'].assign_o_to, o, 'Pasha')
 
+    def test_group_person_records(self):
+        """ Person records hold domain, capital and owned objects and are viewed by domains and capitals """
+
+        group = self.groups['normal']
+        person = 'Vasia'
+        group.assign_o_to(1, person)
+        group.assign_o_to(2, person)
+        group.take_away_o(1)
+        record = group.persons[person]
+        self.assertFalse(hasattr(record, '__dict__'), 'record is slotted')
+        self.assertIs(record.group, group)
+        self.assertIs(group.domains[person], record.domain)
+        self.assertEqual((record.capital, record.objects), (1, {2}))
+        self.assertEqual(group.capitals, {**dict.fromkeys(self.domains, 0), person: 1})
+
 
 class GroupNormalTest(unittest.TestCase):
     """ Person adding/removing and automatic objects assignments in group test"""
@@ -119,9 +182,8 @@ class GroupNormalTest(unittest.TestCase):
         """ Adding 2 persons"""
 
         # No persons initially
-        self.groups['normal'].domains = {}
-        self.groups['normal'].capitals = {}
-        Group.owner_of_o = [None]*len(Group.owner_of_o)
+        self.groups['normal'] = Group()
+        Group.reset_objects(len(Group.owner_of_o))
 
         # Add person Vasia
         # ----------------
@@ -226,8 +288,7 @@ class GroupNormalTest(unittest.TestCase):
         # ----------------------------------------------------------
         N = 10
         for i in range(N):
-            Group.owner_of_o = [None] * self.number_of_objects
-            self.groups['normal'].capitals = {}.fromkeys(self.domains, 0)
+            take_away_all(self.groups['normal'])
             for o in range(self.number_of_objects):
                 try:
                     person = choice([p for p, d in self.domains.items() if o in d])
@@ -245,21 +306,34 @@ class GroupNormalTest(unittest.TestCase):
             #                         msg=f'{i}. evened out distribution: {Group.owner_of_o}')
             self.assertEqual(variance_after, 0)
 
-    def test5_group_poorest_acceptor(self):
-        """ Is output of poorest_acceptor(o) is poorest possible owner of o if any, else None """
+    def test6_group_even_out_tolerance(self):
+        """ even_out() stops when capitals differ by at most tolerance """
 
-        # Test for each object with following logic:
-        # Pasha is poorest so if object in its domain return 'Pasha',
-        # else if object in Vasia's domain return 'Vasia',
-        # else return None
-        for o in range(self.number_of_objects):
-            msg = f'Testing object {o}'
-            if o in self.groups['normal'].domains['Pasha']:
-                self.assertEqual(self.groups['normal'].poorest_acceptor(o), 'Pasha', msg=msg)
-            elif o in self.groups['normal'].domains['Vasia']:
-                self.assertEqual(self.groups['normal'].poorest_acceptor(o), 'Vasia', msg=msg)
-            else:
-                self.assertIsNone(self.groups['normal'].poorest_acceptor(o), msg=msg)
+        # Capitals from setUp: {'Vasia': 4, 'Pasha': 2}
+        group = self.groups['normal']
+        group.tolerance = 2
+        group.need_even_out = True
+        self.assertTrue(group.even_out())
+        self.assertEqual(group.capitals, {'Vasia': 4, 'Pasha': 2}, msg='spread 2 is tolerated')
+        self.assertEqual(group.n_cycles, 0, msg='no exchanges are performed')
+
+        group.tolerance = 1
+        group.need_even_out = True
+        group.even_out()
+        self.assertEqual(group.capitals, {'Vasia': 3, 'Pasha': 3}, msg='spread 2 is not tolerated')
+        self.assertRaises(ValueError, Group, tolerance=0)
+
+    def test8_group_distribute_objects(self):
+        """ Free objects are distributed at once to poorest possible owners, objects without owners stay free """
+
+        group = self.groups['normal']
+        for o in (1, 2, 3, 4):
+            group.take_away_o(o)
+        o_left = group.distribute_objects({1, 2, 3, 4, 7})
+        self.assertEqual(o_left, {7}, 'object without possible owners is returned')
+        self.assertEqual(group.capitals, {'Vasia': 3, 'Pasha': 3}, 'capitals are evened out')
+        self.assertEqual({o for o, p in enumerate(Group.owner_of_o) if p == 'Vasia'} & {1, 2}, {1, 2},
+                         'objects which only Vasia can own are assigned to Vasia')
 
 
 class GroupLowprioTest(unittest.TestCase):
@@ -284,8 +358,9 @@ class GroupLowprioTest(unittest.TestCase):
             self.groups['normal'].add_person(person, self.domains[person])
         self.assertTrue(self.groups['normal'].need_even_out, msg=
         'Adding persons to normal group must set flag of need to even out the capitals of normal')
-        self.assertTrue(self.groups['lowprio'].need_even_out, msg=
-        'Adding persons to normal group must set flag of need to even out the capitals of lowprio')
+        self.assertFalse(self.groups['lowprio'].need_even_out, msg=
+        'Adding persons to normal group must not set flag of need to even out the capitals of lowprio '
+        'if active domains of lowprio are not changed')
         self.assertEqual(Group.owner_of_o, [None, 'Vasia', 'Vasia', 'Pasha', 'Pasha', 'Pasha', 'Pasha', None, None, None], msg="free objects are "
         "assigned when they in domain of new normal person")  # last person gets last free object(s)
 
@@ -385,6 +460,35 @@ class GroupLowprioTest(unittest.TestCase):
         for prop, data in normal_properties.items():
             self.assertEqual(getattr(self.groups['normal'], prop), data, msg + prop)
 
+    def test_group_remove_lowprio_person_incremental(self):
+        """ Removing lowprio person updates only its objects in unions and not recalculates active domains """
+
+        group = self.groups['lowprio']
+        domain_Maia = group.domains['Maia']
+        group.remove_person('Taia')
+        self.assertIs(group.domains['Maia'], domain_Maia, 'active domain of other person is not recalculated')
+        self.assertEqual(group.domain_given_union, self.domains_lowprio['Maia'])
+        self.assertEqual(group.domain_counts, dict.fromkeys(self.domains_lowprio['Maia'], 1))
+        self.assertEqual(group.domain_union, {0, 9})
+
+        group.remove_person('Maia')
+        self.assertEqual((group.domain_given_union, group.domain_union, group.domain_counts), (set(), set(), {}))
+
+    def test_group_update_active_domains_of_holders(self):
+        """ Covering objects by normal group changes active domains of persons holding these objects only """
+
+        group = self.groups['lowprio']
+        self.assertEqual(group.domain_holders[4], {'Taia', 'Maia'})
+        group.persons['Maia'].domain = frozenset(group.persons['Maia'].domain)  # must not be changed
+        self.groups['normal'].add_person('Petia', {7, 8})
+        self.assertEqual(group.domains['Taia'], {9}, 'active domain of holder is updated')
+        self.assertEqual(group.domain_union, {0, 9})
+        self.groups['normal'].remove_person('Petia')
+        self.assertEqual(group.domains['Taia'], {7, 8, 9}, 'active domain of holder is restored')
+
+        group.remove_person('Taia')
+        self.assertEqual(group.domain_holders, dict.fromkeys(self.domains_lowprio['Maia'], {'Maia'}))
+
 
 class WorldTest(unittest.TestCase):
     """
@@ -447,6 +551,450 @@ class WorldTest(unittest.TestCase):
         self.assertEqual(self.World.n_persons, 1, msg=msg + "persons counter increases")
         self.assertEqual(self.World.step, 3, msg=msg + "steps counter increases")
 
+    def test4_world_even_out_budget(self):
+        """ Test that with EOCA budget evening out stays pending and can be resumed """
+        world = World(number_of_objects=10, max_cycles=1)
+        for domain in ({0, 1, 2, 3, 4}, {2, 3, 4, 5, 6, 7}):
+            world.add_person(domain=domain)
+        world.max_cycles = 0
+        world.add_person(domain={0, 1, 2, 3})
+        msg = 'Test EOCA budget: '
+        self.assertEqual(world.groups['normal'].capitals[2], 0, msg=msg +
+                         "mandatory steps only are done if budget is zero")
+        self.assertFalse(world.balanced, msg=msg + "evening out is pending")
+
+        step, n_transfers = world.step, world.n_transfers
+        self.assertFalse(world.even_out(max_cycles=1), msg=msg + "evening out is pending after 1 cycle")
+        self.assertEqual(world.groups['normal'].capitals[2], 1, msg=msg + "resumed evening out is done")
+        self.assertEqual((world.transfers, world.n_transfers, world.step), (1, n_transfers + 1, step), msg=msg +
+                         "transfers of resumed evening out are counted but not step")
+        self.assertTrue(world.even_out(), msg=msg + "unlimited evening out is finished")
+        self.assertTrue(world.balanced)
+        self.assertEqual(sorted(world.groups['normal'].capitals.values()), [2, 3, 3], msg=msg +
+                         "capitals are evened out")
+
+        for budget in ({'max_cycles': 0}, {'time_budget': 0.0}):
+            world = World(number_of_objects=4, **budget)
+            world.add_person(domain={0, 1})
+            self.assertTrue(world.balanced, msg=msg + f"fair distribution is not pending with {budget}")
+            self.assertEqual(world.verify(), [])
+
+    def test5_world_update_domain(self):
+        """ Test that update_domain reassigns only objects of changed part of domain """
+        self.World.add_person('Vasia', {1, 2, 3})
+        self.World.add_person('Pasha', {3, 4, 5})
+        self.World.add_person('Maia', {5, 6, 7}, lowprio=True)
+        self.assertEqual(Group.owner_of_o, [
+            None, 'Vasia', 'Vasia', 'Vasia', 'Pasha',
+            'Pasha', 'Maia', 'Maia', None, None])
+
+        msg = 'Test update_domain: '
+        self.World.update_domain('Pasha', {2, 3, 4, 6})
+        self.assertEqual(Group.owner_of_o, [
+            None, 'Vasia', 'Vasia', 'Vasia', 'Pasha',
+            'Maia', 'Pasha', 'Maia', None, None], msg=msg +
+            "removed object goes to lowprio person, lowprio object of added part goes to normal person")
+        self.assertEqual(self.World.transfers, 2, msg=msg + "only changed objects are transferred")
+        self.assertEqual(self.World.groups['lowprio'].domains['Maia'], {5, 7}, msg=msg +
+                         "lowprio active domain is updated")
+
+        self.World.update_domain('Maia', {1, 8})
+        self.assertEqual(Group.owner_of_o, [
+            None, 'Vasia', 'Vasia', 'Vasia', 'Pasha',
+            None, 'Pasha', None, 'Maia', None], msg=msg + "lowprio person domain is updated")
+        self.assertEqual(self.World.n_persons, 3, msg=msg + "persons counter is not changed")
+        self.assertEqual(self.World.step, 5, msg=msg + "steps counter increases")
+
+    def test6_world_add_retire_objects(self):
+        """ Test of growth and shrinkage of objects space """
+        world = World(number_of_objects=6)
+        world.add_person('Vasia', {0, 1, 2})
+        world.add_person('Pasha', {2, 3})
+        world.add_person('Maia', {4, 5}, lowprio=True)
+        self.assertEqual(Group.owner_of_o, ['Vasia', 'Vasia', 'Pasha', 'Pasha', 'Maia', 'Maia'])
+
+        msg = 'Test add_objects: '
+        o_new = world.add_objects(4, rights={'Pasha': [0, 1, 2], 'Vasia': [2], 'Maia': [3]})
+        self.assertEqual(o_new, [6, 7, 8, 9], msg=msg + "new objects are appended")
+        self.assertIs(world.owner_of_o, Group.owner_of_o, msg=msg + "owners distribution grows in place")
+        self.assertEqual(Group.owner_of_o[6:], ['Pasha', 'Pasha', 'Vasia', 'Maia'], msg=msg +
+                         "new objects are assigned to poorest possible owners")
+        self.assertEqual(world.groups['normal'].domains['Pasha'], {2, 3, 6, 7, 8}, msg=msg + "domains extended")
+        self.assertEqual(world.groups['lowprio'].domains['Maia'], {4, 5, 9}, msg=msg +
+                         "lowprio active domain extended")
+
+        msg = 'Test retire_objects: '
+        world.retire_objects([0, 1, 6])
+        self.assertEqual(Group.owner_of_o[:7], [None, None, 'Vasia', 'Pasha', 'Maia', 'Maia', None], msg=msg +
+                         "retired objects are taken away, capitals are evened out")
+        self.assertEqual(world.groups['normal'].capitals, {'Vasia': 2, 'Pasha': 2})
+        self.assertEqual(world.groups['normal'].domain_union, {2, 3, 7, 8}, msg=msg +
+                         "retired objects are deleted from domains")
+        self.assertEqual(world.n_objects, 7)
+
+        self.assertEqual(world.add_objects(2, rights={'Vasia': [0, 1]}), [0, 1], msg=msg +
+                         "retired objects indexes are reused")
+        self.assertEqual(world.retired, {6})
+        self.assertEqual(world.groups['normal'].capitals, {'Vasia': 3, 'Pasha': 3})
+
+        msg = 'Test domains of callers are not changed: '
+        domain = {2, 3}
+        world.add_person('Petia', domain)
+        world.add_person('Kolia', domain)
+        world.add_person('Sasha')
+        o_new = world.add_objects(1, rights={'Petia': [0]})
+        world.retire_objects([3])
+        self.assertEqual(domain, {2, 3}, msg=msg + 'domain passed to add_person')
+        self.assertEqual(world.groups['normal'].domains['Kolia'], {2}, msg=msg + 'domains are not shared')
+        self.assertEqual(world.groups['normal'].domain_counts[o_new[0]], 1)
+        world.add_person('Olia')
+        self.assertEqual(world.groups['normal'].domains['Olia'], set(), msg=msg + 'default domain')
+
+        msg = 'Test invalid arguments are rejected before changes: '
+        n_objects, step = len(world.owner_of_o), world.step
+        self.assertRaises(ValueError, world.add_objects, 2, rights={'X': [0]})
+        self.assertRaises(ValueError, world.add_objects, 2, rights={'Petia': [2]})
+        self.assertRaises(ValueError, world.retire_objects, [99])
+        self.assertEqual((len(world.owner_of_o), world.step), (n_objects, step), msg=msg)
+        self.assertIsNone(world._operation, msg=msg)
+        self.assertEqual(world.verify(), [])
+
+    def test7_world_instruments(self):
+        """ Test counters of operations work and tracing callbacks """
+        events = []
+        self.World.instruments = Instrumentation(callbacks=[lambda event, data: events.append((event, data))])
+        self.assertIs(self.World.groups['lowprio'].instruments, self.World.instruments, "instruments are shared")
+        for domain in ({0, 1, 2, 3, 4}, {2, 3, 4, 5, 6, 7}):
+            self.World.add_person(domain=domain)
+        self.World.add_person(domain={8, 9}, lowprio=True)
+        self.World.add_person(domain={0, 1, 2, 3, 9})
+
+        msg = 'Test instruments: '
+        operation = self.World.instruments.operation
+        self.assertEqual(self.World.instruments.operation_name, 'add_person')
+        self.assertEqual(operation['displaced'], 1, msg=msg + "object of lowprio person is counted")
+        self.assertEqual(operation['pulled_normal'], 1, msg=msg + "object taken by new person is counted")
+        self.assertEqual(operation['displaced'] + operation['pulled_normal'] + operation['path_transfers_normal'],
+                         operation['transfers_normal'], msg=msg +
+                         "objects are displaced, taken by new person or exchanged along paths once")
+        self.assertEqual(operation['transfers_normal'], self.World.transfers, msg=msg +
+                         "transfers are counted by group")
+        self.assertGreater(operation['bfs_nodes_normal'], 0)
+        for phase in ('time_assign_free', 'time_displace', 'time_fair_share', 'time_even_out',
+                      'time_active_domains'):
+            self.assertIn(phase, operation, msg=msg + "phase time is measured")
+        self.assertEqual(self.World.instruments.n_operations, 4)
+        self.assertEqual(self.World.instruments.totals['paths_normal'],
+                         self.World.groups['normal'].n_cycles, msg=msg + "totals are summed")
+
+        self.assertEqual([event for event, data in events].count('end'), 4, msg=msg + "callbacks are called")
+        self.assertEqual(events[-1][1]['operation'], 'add_person')
+        self.assertEqual(sum(event == 'path' for event, data in events), self.World.groups['normal'].n_cycles)
+
+        self.World.instruments = None
+        self.World.remove_person(0)
+        self.assertIsNone(self.World.groups['normal'].instruments, msg=msg + "counting can be disabled")
+
+    def test8_world_metrics(self):
+        """ Test latency histograms and metrics export """
+        self.World.add_person('Vasia', {1, 2, 3})
+        self.World.add_person('Pasha', {3, 4})
+        self.World.remove_person('Pasha')
+
+        msg = 'Test metrics: '
+        counts, seconds_sum = self.World.metrics.histograms['add_person']
+        self.assertEqual(sum(counts), 2, msg=msg + "operations latency is recorded")
+        self.assertGreater(seconds_sum, 0)
+        self.World.metrics.observe('add_person', 100)
+        self.assertEqual(self.World.metrics.histograms['add_person'][0][-1], 1, msg=msg + "+Inf bucket")
+
+        text = self.World.metrics.to_prometheus(self.World)
+        self.assertIn('joint_ownership_operation_seconds_count{operation="add_person"} 3', text)
+        self.assertIn('joint_ownership_operation_seconds_bucket{operation="remove_person",le="+Inf"} 1', text)
+        self.assertIn('joint_ownership_capital_spread{group="normal"} 0', text)
+        self.assertIn('joint_ownership_free_objects 7', text)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'metrics.prom')
+            self.World.metrics.write_textfile(path, self.World)
+            with open(path) as f:
+                self.assertEqual(f.read(), text, msg=msg + "written to file")
+            self.assertEqual(os.listdir(tmp_dir), ['metrics.prom'], msg=msg + "temporary file is replaced")
+
+            if hasattr(socket, 'AF_UNIX'):
+                address = os.path.join(tmp_dir, 'metrics.sock')
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+                    server.bind(address)
+                    server.listen(1)
+                    self.World.metrics.send(address, self.World)
+                    connection, _ = server.accept()
+                    with connection:
+                        received = b''.join(iter(lambda: connection.recv(4096), b''))
+                self.assertEqual(received.decode(), text, msg=msg + "sent to socket")
+
+            msg = 'Test background export: '
+            metrics = self.World.metrics
+            metrics.start_export(self.World, interval=0.001, path=path, address=os.path.join(tmp_dir, 'no.sock'))
+            try:
+                for i in range(300):
+                    self.World.add_person(domain={i % 10, (i + 3) % 10})
+                    self.World.remove_person(self.World.add_person(domain={i % 10}))
+                self.assertIsInstance(metrics.export_error, OSError, msg=msg + "error is kept")
+                self.assertIsNotNone(metrics._timer, msg=msg + "export continues after error")
+                while not metrics._snapshot_requested:  # export after last operation
+                    time.sleep(0.001)
+                self.World.add_person(domain={0})
+                self.assertEqual(metrics.snapshot[1], metrics.gauges(self.World),
+                                 msg=msg + "requested snapshot is taken at end of operation")
+            finally:
+                metrics.stop_export()
+            self.assertIsNone(metrics.snapshot)
+
+            metrics.start_export(self.World, interval=3600, path=path)
+            try:
+                self.World.add_person(domain={1})  # takes snapshot requested after first export
+                snapshot = metrics.snapshot
+                self.World.add_person(domain={2})
+                self.assertIs(metrics.snapshot, snapshot, msg=msg + "snapshot is not taken until export requests")
+            finally:
+                metrics.stop_export()
+            with open(path) as f:
+                self.assertIn('joint_ownership_persons{group="normal"}', f.read(), msg=msg + "written to file")
+
+        self.assertIsNone(World(10, metrics=False).metrics, msg="Test metrics: recording can be disabled")
+
+
+    def test9_world_verify(self):
+        """ verify() certificate is empty for evened out distribution and lists problems of broken ones """
+        self.World.add_person('Vasia', {0, 1, 2, 3})
+        self.World.add_person('Pasha', {2, 3, 4, 5})
+        self.World.add_person('Masha', {4, 5, 6, 7})
+        self.World.add_person('Taia', {8}, lowprio=True)
+        self.assertEqual(self.World.verify(), [], 'distribution is fair')
+
+        group = self.World.groups['normal']
+        for o, person in enumerate(['Vasia'] * 4 + ['Pasha'] * 2 + ['Masha'] * 2):
+            if Group.owner_of_o[o] != person:
+                group.take_away_o(o)
+                group.assign_o_to(o, person)
+        self.assertEqual(self.World.verify(), [
+            "normal: exchange chain from 'Pasha' (capital 2) to person of capital 4",
+            "normal: exchange chain from 'Masha' (capital 2) to person of capital 4"],
+            'chain of Masha to Vasia through Pasha is found')
+
+        self.World.groups['lowprio'].take_away_o(8)
+        group.persons['Masha'].capital += 1
+        problems = self.World.verify()
+        self.assertIn('object 8 is free but has eligible persons', problems)
+        self.assertIn("normal: capital 3 of 'Masha' != number of its objects 2", problems)
+
+    def test9_world_verify_owners_index(self):
+        """ verify() checks index of owners against persons objects and capitals """
+        self.World.add_person('a', {0, 1, 2})
+        self.World.add_person('b', {2, 3, 4, 5})
+        self.assertEqual(self.World.verify(), [])
+        record = self.World.persons['a']
+        o = min(record.objects)
+        record.objects.discard(o)
+        record.capital -= 1
+        self.assertEqual(self.World.verify(), [
+            f"normal: object {o} is owned by 'a' but not in its objects",
+            f"normal: capital {record.capital} of 'a' != number of objects it owns {record.capital + 1}"])
+
+    def test10_world_persons_registry(self):
+        """ Registry maps persons to their records and groups, auto-names of removed persons are reused """
+        for domain in ({0, 1}, {1, 2}, {2, 3}, {3, 4}):
+            self.World.add_person(domain=domain)
+        self.World.add_person(domain={5}, lowprio=True)
+        self.assertEqual(list(self.World.persons), [0, 1, 2, 3, 4])
+        self.assertIs(self.World.persons[4].group, self.World.groups['lowprio'])
+        self.assertIs(self.World.persons[1], self.World.groups['normal'].persons[1])
+
+        self.World.remove_person(1)
+        self.World.remove_person(4)
+        self.assertNotIn(4, self.World.persons)
+        self.assertEqual([self.World.add_person(domain={6}) for _ in range(3)], [4, 1, 5],
+                         'last released names are reused first')
+        self.assertEqual(self.World.add_person('Vasia', {7}), 'Vasia')
+        self.assertEqual(self.World.add_person(domain={8}), 7, 'named persons are counted')
+        state = (self.World.step, self.World._next_id, list(Group.owner_of_o))
+        with self.assertRaises(ValueError):
+            self.World.add_person('Vasia', {9})
+        self.assertEqual(self.World.persons['Vasia'].domain, {7})
+        self.assertEqual((self.World.step, self.World._next_id, list(Group.owner_of_o)), state,
+                         'world is unchanged')
+
+    def test11_world_free_objects_index(self):
+        """ Index of free objects is kept by operations and excludes retired objects """
+        self.assertEqual(self.World.o_free, set(range(10)))
+        self.World.add_person('Vasia', {1, 2, 3})
+        self.World.add_person('Taia', {3, 4}, lowprio=True)
+        self.assertEqual(self.World.o_free, {0, 5, 6, 7, 8, 9})
+        self.World.retire_objects({4, 5})
+        self.assertEqual((self.World.o_free, self.World.n_free), ({0, 6, 7, 8, 9}, 5))
+        self.World.add_objects(3, rights={'Taia': [0]})
+        self.assertEqual(self.World.o_free, {0, 6, 7, 8, 9, 5, 10})
+        self.World.remove_person('Vasia')
+        self.assertEqual(self.World.o_free, {0, 1, 2, 6, 7, 8, 9, 5, 10})
+        self.assertEqual(self.World.verify(), [])
+
+    def test12_world_tiers(self):
+        """ Persons of each tier displace persons of lower tiers, changes cascade to lower tiers incrementally """
+        world = World(number_of_objects=8, tiers=('gold', 'silver', 'bronze'))
+        gold, silver, bronze = world.groups.values()
+        world.add_person('Taia', {0, 1, 2, 3, 4, 5}, lowprio=True)
+        world.add_person('Pasha', {3, 4, 5}, tier='silver')
+        self.assertEqual(world.owner_of_o, ['Taia'] * 3 + ['Pasha'] * 3 + [None] * 2,
+                         'silver person displaces bronze person')
+
+        notified = []
+        notify = silver.notify_dependent_group
+        silver.notify_dependent_group = lambda o_covered, o_uncovered: (
+            notified.append((list(o_covered), list(o_uncovered))), notify(o_covered, o_uncovered))
+        world.add_person('Vasia', {5, 6})
+        self.assertEqual(notified, [([6], [])], 'only objects of changed cover are passed to lower tier')
+        self.assertEqual(world.owner_of_o, ['Taia'] * 3 + ['Pasha'] * 2 + ['Vasia'] * 2 + [None])
+        self.assertEqual(bronze.domains['Taia'], {0, 1, 2})
+
+        world.remove_person('Pasha')
+        self.assertEqual(notified[-1], ([], [3, 4]))
+        self.assertEqual(bronze.domains['Taia'], {0, 1, 2, 3, 4}, 'bronze active domain is extended')
+        self.assertEqual(world.owner_of_o, ['Taia'] * 5 + ['Vasia'] * 2 + [None],
+                         'objects of removed person are assigned to lower tier')
+        self.assertEqual(world.verify(), [])
+
+    def test13_world_shared_owners(self):
+        """ Owners are kept in shared memory for readers in other processes """
+        world = self.World
+        for domain in ({0, 1, 2, 3}, {2, 3, 4, 5}):
+            world.add_person(domain=domain)
+        shared = world.share_owners(capacity=12)
+        reader = OwnershipReader(shared.name)
+        try:
+            self.assertEqual(reader.owners(), world.owner_of_o)
+            sequence = reader.sequence
+            world.add_person(domain={3, 4, 5, 6})
+            self.assertEqual(reader.sequence, sequence + 2, 'sequence is even after update')
+            self.assertEqual(reader.owners(), world.owner_of_o, 'changed owners are updated')
+            self.assertEqual((reader.owner(6), reader.owner(9)), (2, None))
+
+            self.assertRaises(ValueError, world.add_person, 'Vasia', {7})
+            self.assertRaises(ValueError, world.add_objects, 3)
+            world.max_cycles = 0
+            world.add_person(domain={0, 1, 2, 3})
+            world.add_objects(2, rights={0: [0, 1]})
+            self.assertFalse(world.balanced)
+            self.assertTrue(world.even_out())
+            self.assertEqual(reader.n_objects, 12)
+            self.assertEqual(reader.owners(), world.owner_of_o, 'changes of even_out() are updated')
+
+            output = subprocess.run(
+                [sys.executable, '-c', 'import sys; from joint_ownership_problem import OwnershipReader\n'
+                                       'with OwnershipReader(sys.argv[1]) as reader: print(reader.owners())',
+                 shared.name], capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+            self.assertEqual(output.strip(), str(world.owner_of_o), 'owners are read in other process')
+            self.assertIn(shared.name, SharedOwnership.created, 'reader in same process keeps segment tracked')
+
+            reader.close()
+            shared_new = world.share_owners(capacity=12)
+            self.assertNotIn(shared.name, SharedOwnership.created, 'previous segment is destroyed')
+            shared = shared_new
+            reader = OwnershipReader(shared.name)
+            self.assertEqual(reader.owners(), world.owner_of_o)
+        finally:
+            reader.close()
+            shared.close()
+
+    def test14_world_transaction(self):
+        """ Changes made in transaction are rolled back unless committed """
+        world = self.World
+        world.add_person('Vasia', {0, 1, 2, 3, 4})
+        world.add_person('Masha', {3, 4, 5, 6}, lowprio=True)
+        owners = list(world.owner_of_o)
+        with world.transaction() as tx:
+            world.add_person('Petia', {0, 1, 5, 6, 7})
+            world.remove_person('Vasia')
+            world.update_domain('Masha', {6, 7, 8})
+            world.add_objects(2, rights={'Petia': [0, 1]})
+            world.retire_objects([7])
+            self.assertEqual(world.owner_of_o, ['Petia'] * 2 + [None] * 3 + ['Petia'] * 2 + [None, 'Masha', None,
+                                                                                    'Petia', 'Petia'])
+            self.assertEqual(tx.changed_owners()[0], ('Vasia', 'Petia'))
+            self.assertRaises(RuntimeError, world.transaction)
+        self.assertEqual(world.owner_of_o, owners)
+        self.assertEqual(world.groups['normal'].domains, {'Vasia': {0, 1, 2, 3, 4}})
+        self.assertEqual(world.groups['lowprio'].domains, {'Masha': {5, 6}})
+        self.assertEqual(world.groups['lowprio'].domains_given, {'Masha': {3, 4, 5, 6}})
+        self.assertEqual(world.groups['normal'].capitals, {'Vasia': 5})
+        self.assertEqual((world.n_persons, world.step, world.retired, world.o_free), (2, 2, set(), {7, 8, 9}))
+        self.assertEqual(world.verify(), [])
+
+        with world.transaction() as tx:
+            world.add_person(domain={7, 8})
+            tx.commit()
+        self.assertEqual(world.owner_of_o[7:], [2, 2, None], 'committed changes are kept')
+
+        with self.assertRaises(KeyError):
+            with world.transaction():
+                world.remove_person(2)
+                world.update_domain('Vasia', {0})
+                raise KeyError()
+        self.assertEqual(world.owner_of_o[7:], [2, 2, None], 'changes are rolled back on exception')
+        self.assertEqual(world.verify(), [])
+
+
+class TraceTest(unittest.TestCase):
+    """ Test of traces of persons flow reading/writing and replay """
+    events = [('add', 0, {0, 1, 2, 3, 4}, False),
+              ('add', 1, {2, 3, 4, 5, 6, 7}, False),
+              ('add', 2, {0, 1, 2, 3}, False),
+              ('remove', 2),
+              ('add', 2, {6, 7, 8, 9, 10, 11, 12}, True),
+              ('add', 3, {5, 6, 7, 8, 9, 10}, True),
+              ('add', 4, {5, 6, 7, 8}, False)]  # README example
+
+    def test_write_read_trace(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for trace_format in ('jsonl', 'bin'):
+                path = os.path.join(tmp_dir, 'trace.' + trace_format)
+                write_trace(path, iter(self.events), 13)
+                n_objects, events = read_trace(path)
+                self.assertEqual(n_objects, 13, msg=trace_format)
+                self.assertEqual(list(events), self.events, msg=trace_format)
+
+            path = os.path.join(tmp_dir, 'no_header.jsonl')
+            with open(path, 'w') as f:
+                f.write(json.dumps({'op': 'add', 'person': 'Vasia', 'domain': [1, 2]}) + '\n')
+            n_objects, events = read_trace(path)
+            self.assertIsNone(n_objects)
+            self.assertEqual(list(events), [('add', 'Vasia', {1, 2}, False)], msg='header is optional')
+
+    def test_replay(self):
+        for batch in (1, 3):
+            world, report = replay(iter(self.events), 13, batch=batch)
+            msg = f'Replay with batch={batch}: '
+            self.assertEqual(report['events'], len(self.events))
+            self.assertEqual(sorted(world.groups['normal'].capitals.values()), [3, 3, 3], msg=msg + "capitals")
+            self.assertEqual(report['capital_spread'], {'normal': 0, 'lowprio': 0}, msg=msg + "fairness")
+            self.assertTrue(report['balanced'], msg=msg + "capitals are evened out at the end")
+            self.assertEqual(report['free_objects'], 0)
+            self.assertEqual('even_out' in report['latency_ms'], batch > 1)
+
+    def test_main_replay(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'trace.bin')
+            write_trace(path, self.events + [('remove', 9), ('add', 10, {12, 13}, False)], 13)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                main(['replay', path, '--batch', '2'])
+        report = json.loads(output.getvalue())  # output is only report
+        self.assertEqual(report['events'], len(self.events) + 2)
+        self.assertEqual(report['unknown_persons'], 1, 'removing of unknown person is counted')
+        self.assertEqual(report['invalid_objects'], 1, 'adding person with object out of range is counted')
+        self.assertEqual(report['persons'], 5)
+
+
 # Task statement requires no main!
 # if __name__ == '__main__':
 #     unittest.main(verbosity=2)